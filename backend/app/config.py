@@ -1,79 +1,123 @@
 import os
-from typing import List
-from pydantic import BaseModel
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, List, Mapping, Optional
 
-class AppConfig(BaseModel):
+
+def _as_bool(value: str) -> bool:
+    return value.lower() == "true"
+
+
+def _env_field(reader: Callable[[Mapping[str, str]], Any]):
+    """声明一个从环境变量读取的配置字段
+
+    直接实例化时读取 os.environ；AppConfig.from_env 则从给定的环境快照读取。
+    """
+    return field(default_factory=lambda: reader(os.environ), metadata={"from_env": reader})
+
+
+def _env(name: str, default: str = "", cast: Callable[[str], Any] = str, fallback: Optional[str] = None):
+    """fallback 为备用环境变量名，主变量未设置时使用其值"""
+    def reader(env: Mapping[str, str]):
+        value = env.get(name)
+        if value is None:
+            value = env.get(fallback, default) if fallback else default
+        return cast(value)
+    return _env_field(reader)
+
+
+def _parse_providers(env: Mapping[str, str]) -> List[str]:
+    providers_str = env.get("LLM_PROVIDERS", "openai,deepseek,gemini,doubao")
+    return [p.strip().lower() for p in providers_str.split(",") if p.strip()]
+
+
+@dataclass(frozen=True, slots=True)
+class AppConfig:
     """应用配置，支持 LangChain 组件配置"""
-    app_env: str = os.getenv("APP_ENV", "dev")
-    api_host: str = os.getenv("API_HOST", "0.0.0.0")
-    api_port: int = int(os.getenv("API_PORT", "8000"))
+    app_env: str = _env("APP_ENV", "dev")
+    api_host: str = _env("API_HOST", "0.0.0.0")
+    api_port: int = _env("API_PORT", "8000", int)
 
     # 向量存储
-    vector_store: str = os.getenv("VECTOR_STORE", "chroma")  # milvus | chroma
-    chroma_dir: str = os.getenv("CHROMA_DIR", "app/storage/chroma")
-    milvus_host: str = os.getenv("MILVUS_HOST", "localhost")
-    milvus_port: str = os.getenv("MILVUS_PORT", "19530")
+    vector_store: str = _env("VECTOR_STORE", "chroma")  # milvus | chroma
+    chroma_dir: str = _env("CHROMA_DIR", "app/storage/chroma")
+    milvus_host: str = _env("MILVUS_HOST", "localhost")
+    milvus_port: str = _env("MILVUS_PORT", "19530")
 
     # 文档处理配置
-    chunk_size: int = int(os.getenv("CHUNK_SIZE", "1000"))
-    chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", "200"))
+    chunk_size: int = _env("CHUNK_SIZE", "1000", int)
+    chunk_overlap: int = _env("CHUNK_OVERLAP", "200", int)
     
     # 检索配置
-    retriever_type: str = os.getenv("RETRIEVER_TYPE", "hybrid")  # vector, bm25, hybrid
-    hybrid_alpha: float = float(os.getenv("HYBRID_ALPHA", "0.6"))  # 向量检索权重
-    reranker_type: str = os.getenv("RERANKER_TYPE", "mmr")  # basic, mmr
-    mmr_lambda: float = float(os.getenv("MMR_LAMBDA", "0.7"))  # 多样性参数
-    top_k_retrieval: int = int(os.getenv("TOP_K_RETRIEVAL", "10"))  # 检索数量
+    retriever_type: str = _env("RETRIEVER_TYPE", "hybrid")  # vector, bm25, hybrid
+    hybrid_alpha: float = _env("HYBRID_ALPHA", "0.6", float)  # 向量检索权重
+    fusion_strategy: str = _env("FUSION_STRATEGY", "rrf")  # 混合检索融合方式：rrf, weighted
+    rrf_k: int = _env("RRF_K", "10", int)  # RRF 平滑常数
+    reranker_type: str = _env("RERANKER_TYPE", "mmr")  # basic, mmr, cross_encoder
+    cross_encoder_model: str = _env("CROSS_ENCODER_MODEL", "BAAI/bge-reranker-base")
+    cross_encoder_onnx: bool = _env("CROSS_ENCODER_ONNX", "false", _as_bool)  # 使用 ONNX int8 量化模型
+    rerank_candidates: int = _env("RERANK_CANDIDATES", "20", int)  # 交叉编码器重排前的召回数量
+    mmr_lambda: float = _env("MMR_LAMBDA", "0.7", float)  # 多样性参数
+    top_k_retrieval: int = _env("TOP_K_RETRIEVAL", "10", int)  # 检索数量
 
     # Embeddings
-    embedding_provider: str = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai | hf
-    embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
-    openai_embed_base_url: str = os.getenv("OPENAI_EMBED_BASE_URL", "https://api.openai.com/v1")
-    openai_embed_api_key: str = os.getenv("OPENAI_EMBED_API_KEY", os.getenv("LLM_API_KEY", ""))  # 复用密钥
+    embedding_provider: str = _env("EMBEDDING_PROVIDER", "openai")  # openai | hf
+    embedding_model: str = _env("EMBEDDING_MODEL", "text-embedding-3-large")
+    openai_embed_base_url: str = _env("OPENAI_EMBED_BASE_URL", "https://api.openai.com/v1")
+    openai_embed_api_key: str = _env("OPENAI_EMBED_API_KEY", fallback="LLM_API_KEY")  # 复用密钥
     
     # HuggingFace Embeddings
-    hf_embedding_model: str = os.getenv("HF_EMBEDDING_MODEL", "BAAI/bge-large-zh-v1.5")
+    hf_embedding_model: str = _env("HF_EMBEDDING_MODEL", "BAAI/bge-large-zh-v1.5")
+
+    # 嵌入缓存（条目数为 0 表示关闭；路径为空表示仅内存缓存）
+    embedding_cache_size: int = _env("EMBEDDING_CACHE_SIZE", "10000", int)
+    embedding_cache_path: str = _env("EMBEDDING_CACHE_PATH")
+
+    # 语义查询缓存（条目数为 0 表示关闭）
+    semantic_cache_size: int = _env("SEMANTIC_CACHE_SIZE", "1000", int)
+    semantic_cache_threshold: float = _env("SEMANTIC_CACHE_THRESHOLD", "0.95", float)
+    semantic_cache_ttl: float = _env("SEMANTIC_CACHE_TTL", "3600", float)  # 秒
     
     # LLM 多提供方
     # 全局默认
-    llm_provider: str = os.getenv("LLM_PROVIDER", "openai")
-    llm_base_url: str = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
-    llm_api_key: str = os.getenv("LLM_API_KEY", "")
-    llm_model: str = os.getenv("LLM_MODEL", "gpt-4o-mini")
+    llm_provider: str = _env("LLM_PROVIDER", "openai")
+    llm_base_url: str = _env("LLM_BASE_URL", "https://api.openai.com/v1")
+    llm_api_key: str = _env("LLM_API_KEY")
+    llm_model: str = _env("LLM_MODEL", "gpt-4o-mini")
 
     # 提供方列表（优先级顺序），例如 "openai,deepseek,gemini,doubao"
-    providers_raw: str = os.getenv("LLM_PROVIDERS", "openai")
-    llm_providers: List[str] = []
+    providers_raw: str = _env("LLM_PROVIDERS", "openai")
+    llm_providers: List[str] = _env_field(_parse_providers)
 
     # OpenAI
-    openai_base_url: str = os.getenv("OPENAI_BASE_URL", os.getenv("LLM_BASE_URL", "https://api.openai.com/v1"))
-    openai_api_key: str = os.getenv("OPENAI_API_KEY", os.getenv("LLM_API_KEY", ""))
-    openai_model: str = os.getenv("OPENAI_MODEL", os.getenv("LLM_MODEL", "gpt-4o-mini"))
+    openai_base_url: str = _env("OPENAI_BASE_URL", "https://api.openai.com/v1", fallback="LLM_BASE_URL")
+    openai_api_key: str = _env("OPENAI_API_KEY", fallback="LLM_API_KEY")
+    openai_model: str = _env("OPENAI_MODEL", "gpt-4o-mini", fallback="LLM_MODEL")
 
     # DeepSeek (OpenAI 兼容)
-    deepseek_base_url: str = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
-    deepseek_api_key: str = os.getenv("DEEPSEEK_API_KEY", "")
-    deepseek_model: str = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+    deepseek_base_url: str = _env("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+    deepseek_api_key: str = _env("DEEPSEEK_API_KEY")
+    deepseek_model: str = _env("DEEPSEEK_MODEL", "deepseek-chat")
 
     # Gemini (Google Generative Language API)
-    gemini_api_key: str = os.getenv("GEMINI_API_KEY", "")
-    gemini_model: str = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+    gemini_api_key: str = _env("GEMINI_API_KEY")
+    gemini_model: str = _env("GEMINI_MODEL", "gemini-1.5-pro")
 
     # Doubao (ByteDance/Volcano Ark, OpenAI 兼容)
-    doubao_base_url: str = os.getenv("DOUBAO_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
-    doubao_api_key: str = os.getenv("DOUBAO_API_KEY", "")
-    doubao_model: str = os.getenv("DOUBAO_MODEL", "ep-20250609121409-9882n")
+    doubao_base_url: str = _env("DOUBAO_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+    doubao_api_key: str = _env("DOUBAO_API_KEY")
+    doubao_model: str = _env("DOUBAO_MODEL", "ep-20250609121409-9882n")
 
     # 知识图谱
-    enable_kg: bool = os.getenv("ENABLE_KG", "false").lower() == "true"
-    neo4j_uri: str = os.getenv("NEO4J_URI", "bolt://neo4j:7687")
-    neo4j_user: str = os.getenv("NEO4J_USER", "neo4j")
-    neo4j_password: str = os.getenv("NEO4J_PASSWORD", "password")
+    enable_kg: bool = _env("ENABLE_KG", "false", _as_bool)
+    neo4j_uri: str = _env("NEO4J_URI", "bolt://neo4j:7687")
+    neo4j_user: str = _env("NEO4J_USER", "neo4j")
+    neo4j_password: str = _env("NEO4J_PASSWORD", "password")
+
+    @classmethod
+    def from_env(cls, env: Mapping[str, str]) -> "AppConfig":
+        """从环境变量快照构建配置"""
+        return cls(**{f.name: f.metadata["from_env"](env) for f in fields(cls)})
 
 def load_config() -> AppConfig:
-    """加载配置"""
-    cfg = AppConfig()
-    # 解析 LLM_PROVIDERS 环境变量
-    providers_str = os.getenv("LLM_PROVIDERS", "openai,deepseek,gemini,doubao")
-    cfg.llm_providers = [p.strip().lower() for p in providers_str.split(",") if p.strip()]
-    return cfg
\ No newline at end of file
+    """加载配置（对 os.environ 做一次快照后统一读取）"""
+    return AppConfig.from_env(os.environ.copy())
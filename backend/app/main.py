@@ -5,21 +5,54 @@ NotebookLM-like RAG API
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import json
+import logging
 import os
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 import time
+from functools import lru_cache
 from dotenv import load_dotenv, find_dotenv
+import orjson
 import pickle
 
 from app.config import load_config
 from app.services.rag.langchain_pipeline import LangChainRAGPipeline
 
+logger = logging.getLogger(__name__)
+
+def _orjson_default(obj: Any) -> str:
+    """orjson 无法原生编码的对象：bytes 按 UTF-8 解码，其余转为字符串"""
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode('utf-8', errors='ignore')
+    return str(obj)
+
+
+def _orjson_dumps(content: Any) -> bytes:
+    return orjson.dumps(
+        content,
+        default=_orjson_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    )
+
+
+class ORJSONResponse(JSONResponse):
+    """使用 orjson 编码的 JSON 响应，统一声明 UTF-8 编码"""
+    media_type = "application/json; charset=utf-8"
+
+    def render(self, content: Any) -> bytes:
+        return _orjson_dumps(content)
+
+
 # 创建 FastAPI 应用
-app = FastAPI(title="企业级知识库 RAG API", version="1.0.0")
+app = FastAPI(
+    title="企业级知识库 RAG API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
 
 # 添加 CORS 中间件
 app.add_middleware(
@@ -39,31 +72,62 @@ try:
 except Exception as e:
     print(f"警告: 无法挂载静态文件: {e}")
 
-# 确保所有响应使用 UTF-8 编码
-@app.middleware("http")
-async def ensure_utf8_encoding(request, call_next):
-    response = await call_next(request)
-    if response.headers.get("content-type", "").startswith("application/json"):
-        response.headers["content-type"] = "application/json; charset=utf-8"
-    return response
-
 # 加载配置
 # 优先加载项目根/父目录的 .env-local，其次加载 .env
-load_dotenv(find_dotenv(filename=".env-local"))
-load_dotenv(find_dotenv())
+@lru_cache(maxsize=None)
+def _find_dotenv(filename: str = ".env") -> str:
+    """缓存 .env 文件的查找结果，避免重复逐级向上遍历目录"""
+    return find_dotenv(filename=filename)
+
+load_dotenv(_find_dotenv(".env-local"))
+load_dotenv(_find_dotenv())
 cfg = load_config()
 pipeline: Optional[LangChainRAGPipeline] = None
 
 # 笔记本持久化存储路径
-NOTEBOOKS_STORAGE_PATH = os.path.join(os.path.dirname(__file__), "storage", "notebooks.pkl")
+NOTEBOOKS_STORAGE_PATH = os.path.join(os.path.dirname(__file__), "storage", "notebooks.json")
+# 旧版 pickle 存储路径（仅用于迁移读取）
+LEGACY_NOTEBOOKS_STORAGE_PATH = os.path.join(os.path.dirname(__file__), "storage", "notebooks.pkl")
+# 持久化合并窗口（秒）：窗口内的多次修改只落盘一次
+NOTEBOOKS_FLUSH_INTERVAL = 0.5
+# 笔记本有未落盘的修改时置位，由后台任务统一写盘
+notebooks_dirty = asyncio.Event()
+_flush_task: Optional[asyncio.Task] = None
+# /api/notebooks 列表响应的序列化缓存，笔记本变化时置空
+_notebooks_cache: Optional[bytes] = None
+
+def _notebooks_default(obj: Any) -> Any:
+    """笔记本持久化时 orjson 无法原生编码的对象（datetime 等由 orjson 原生处理）
+
+    ULID、Path 等按字符串保存，集合按列表保存；其他类型直接报错，避免写入有损数据。
+    """
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode('utf-8')
+    if hasattr(obj, "str") and isinstance(obj.str, str):
+        # ulid.ULID
+        return obj.str
+    if isinstance(obj, os.PathLike):
+        return os.fspath(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
 
 def save_notebooks():
-    """保存笔记本到磁盘"""
+    """保存笔记本到磁盘（JSON + 原子替换）"""
     try:
         if pipeline and hasattr(pipeline, 'notebooks') and pipeline.notebooks:
             os.makedirs(os.path.dirname(NOTEBOOKS_STORAGE_PATH), exist_ok=True)
-            with open(NOTEBOOKS_STORAGE_PATH, 'wb') as f:
-                pickle.dump(pipeline.notebooks, f)
+            # 始终写 JSON：pickle 只作为旧版文件的读取路径保留
+            data = orjson.dumps(
+                pipeline.notebooks,
+                default=_notebooks_default,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+            tmp_path = NOTEBOOKS_STORAGE_PATH + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, NOTEBOOKS_STORAGE_PATH)
             print(f"已保存 {len(pipeline.notebooks)} 个笔记本")
     except Exception as e:
         print(f"保存笔记本失败: {e}")
@@ -71,15 +135,38 @@ def save_notebooks():
 def load_notebooks():
     """从磁盘加载笔记本"""
     try:
-        if os.path.exists(NOTEBOOKS_STORAGE_PATH):
-            with open(NOTEBOOKS_STORAGE_PATH, 'rb') as f:
-                notebooks = pickle.load(f)
-                print(f"成功加载 {len(notebooks)} 个笔记本")
-                return notebooks
+        for path in (NOTEBOOKS_STORAGE_PATH, LEGACY_NOTEBOOKS_STORAGE_PATH):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                raw = f.read()
+            # 旧版 pickle 文件以协议魔数 0x80 开头
+            if raw[:1] == b"\x80":
+                notebooks = pickle.loads(raw)
+            else:
+                notebooks = orjson.loads(raw)
+            print(f"成功加载 {len(notebooks)} 个笔记本")
+            return notebooks
     except Exception as e:
         print(f"加载笔记本失败: {e}")
     return {}
 
+def _mark_notebooks_changed(persist: bool = True):
+    """笔记本发生变化：使列表缓存失效，并按需标记待保存"""
+    global _notebooks_cache
+    _notebooks_cache = None
+    if persist:
+        notebooks_dirty.set()
+
+async def _flush_notebooks_loop():
+    """后台任务：合并短时间内的多次修改后再写盘，避免阻塞请求路径"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await notebooks_dirty.wait()
+        await asyncio.sleep(NOTEBOOKS_FLUSH_INTERVAL)
+        notebooks_dirty.clear()
+        await loop.run_in_executor(None, save_notebooks)
+
 
 class CreateNotebookRequest(BaseModel):
     name: str
@@ -98,6 +185,8 @@ class UploadTextRequest(BaseModel):
 class QueryRequest(BaseModel):
     question: str
     top_k: Optional[int] = 5
+    # 为 True 时来源只返回出处、得分与内容预览，不返回全文
+    sources_summary_only: bool = False
 
 
 class ProviderRequest(BaseModel):
@@ -127,6 +216,19 @@ async def startup():
         # 仍然设置启动时间，以便健康检查端点正常工作
         app.state.started_at = time.time()
 
+    global _flush_task
+    _flush_task = asyncio.create_task(_flush_notebooks_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _flush_task is not None:
+        _flush_task.cancel()
+    # 写入最后一批未落盘的修改
+    if notebooks_dirty.is_set():
+        notebooks_dirty.clear()
+        save_notebooks()
+
 
 @app.get("/")
 async def root():
@@ -173,13 +275,9 @@ async def create_notebook(req: CreateNotebookRequest):
         raise HTTPException(status_code=503, detail="流水线未就绪")
     try:
         nb = pipeline.create_notebook(req.name)
-        # 保存笔记本到磁盘
-        save_notebooks()
-        # 确保响应使用 UTF-8 编码
-        return JSONResponse(
-            content=nb,
-            headers={"Content-Type": "application/json; charset=utf-8"}
-        )
+        # 标记待保存，由后台任务合并写盘
+        _mark_notebooks_changed()
+        return nb
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -188,11 +286,10 @@ async def create_notebook(req: CreateNotebookRequest):
 async def list_notebooks():
     if pipeline is None:
         raise HTTPException(status_code=503, detail="流水线未就绪")
-    notebooks = list(pipeline.notebooks.values())
-    return JSONResponse(
-        content=notebooks,
-        headers={"Content-Type": "application/json; charset=utf-8"}
-    )
+    global _notebooks_cache
+    if _notebooks_cache is None:
+        _notebooks_cache = _orjson_dumps(list(pipeline.notebooks.values()))
+    return Response(content=_notebooks_cache, media_type=ORJSONResponse.media_type)
 
 
 @app.delete("/api/notebooks/{notebook_id}")
@@ -203,8 +300,8 @@ async def delete_notebook(notebook_id: str):
         raise HTTPException(status_code=404, detail="笔记本不存在")
     try:
         pipeline.delete_notebook(notebook_id)
-        # 保存笔记本到磁盘
-        save_notebooks()
+        # 标记待保存，由后台任务合并写盘
+        _mark_notebooks_changed()
         return {"message": "笔记本删除成功"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -218,6 +315,7 @@ async def upload_to_notebook(notebook_id: str, req: UploadRequest):
         raise HTTPException(status_code=404, detail="笔记本不存在")
     try:
         stats = pipeline.ingest_paths(notebook_id, [req.file_path], req.metadata or {})
+        _mark_notebooks_changed(persist=False)
         return {"message": "ok", "ingested": stats}
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -232,17 +330,18 @@ async def upload_text_to_notebook(notebook_id: str, req: UploadTextRequest):
     if notebook_id not in pipeline.notebooks:
         raise HTTPException(status_code=404, detail="笔记本不存在")
     try:
-        print(f"[MAIN] 收到 uploadText 请求，笔记本 ID: {notebook_id}")
-        print(f"[MAIN] 请求元数据: {req.metadata}")
-        print(f"[MAIN] 文本数量: {len(req.texts)}")
-        print(f"[MAIN] 第一个文本长度: {len(req.texts[0]) if req.texts else 0}")
+        logger.debug("收到 uploadText 请求，笔记本 ID: %s", notebook_id)
+        logger.debug("请求元数据: %s", req.metadata)
+        logger.debug("文本数量: %d", len(req.texts))
+        logger.debug("第一个文本长度: %d", len(req.texts[0]) if req.texts else 0)
         
         stats = pipeline.ingest_texts(notebook_id, req.texts, req.metadata or {})
+        _mark_notebooks_changed(persist=False)
         
-        print(f"[MAIN] 摄入完成: {stats}")
+        logger.debug("摄入完成: %s", stats)
         return {"message": "ok", "ingested": stats}
     except Exception as e:
-        print(f"[MAIN] uploadText 出错: {e}")
+        logger.error("uploadText 出错: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -253,43 +352,21 @@ async def query_notebook(notebook_id: str, req: QueryRequest):
     if notebook_id not in pipeline.notebooks:
         raise HTTPException(status_code=404, detail="笔记本不存在")
     try:
-        result = pipeline.query(notebook_id, req.question, top_k=req.top_k or 5)
-        # 使源文档可序列化，并确保 UTF-8 编码
-        serializable_sources: List[Dict[str, Any]] = []
-        for s in result.get("sources", []):
-            content = s.get("content", "")
-            # 确保内容正确编码为 UTF-8 字符串
-            if isinstance(content, bytes):
-                content = content.decode('utf-8', errors='ignore')
-            elif not isinstance(content, str):
-                content = str(content)
-            
-            serializable_sources.append(
-                {
-                    "content": content,
-                    "metadata": s.get("metadata", {}),
-                    "score": s.get("score", 0.0),
-                }
-            )
-        
-        # 确保答案正确编码
-        answer = result.get("answer", "")
-        if isinstance(answer, bytes):
-            answer = answer.decode('utf-8', errors='ignore')
-        elif not isinstance(answer, str):
-            answer = str(answer)
-            
+        result = await pipeline.aquery(
+            question=req.question,
+            notebook_id=notebook_id,
+            top_k=req.top_k or 5,
+            sources_summary_only=req.sources_summary_only
+        )
         response_data = {
             "question": result.get("question"),
-            "answer": answer,
-            "sources": serializable_sources,
+            "answer": result.get("answer", ""),
+            # _format_sources 已生成最终结构，直接透传
+            "sources": result.get("sources", []),
             "meta": result.get("meta", {}),
         }
         
-        # 返回时明确指定 UTF-8 编码
-        return JSONResponse(
-            content=response_data,
-            headers={"Content-Type": "application/json; charset=utf-8"}
-        )
+        # 直接构造响应，跳过 jsonable_encoder；bytes 等由 _orjson_default 处理
+        return ORJSONResponse(content=response_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
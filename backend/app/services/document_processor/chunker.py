@@ -1,4 +1,7 @@
 from typing import List, Dict, Any, Optional
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
 from langchain.text_splitter import (
     RecursiveCharacterTextSplitter,
     CharacterTextSplitter,
@@ -7,7 +10,33 @@ from langchain.text_splitter import (
 )
 from langchain_core.documents import Document
 from ..config import AppConfig
+import hashlib
+import os
 import re
+import threading
+
+# 句子结束符（中文 + 英文）及其后的空白
+_SENTENCE_BOUNDARY_PATTERN = re.compile(r'[。！？；.!?]\s*')
+_MARKDOWN_HEADER_PATTERN = re.compile(r'^#+\s', re.MULTILINE)
+_CODE_BLOCK_PATTERN = re.compile(r'```')
+_LIST_ITEM_PATTERN = re.compile(r'^\s*[-*+]\s', re.MULTILINE)
+
+# 文本结构分析结果缓存，以内容哈希 + 长度为键，避免缓存原文占用内存
+_ANALYSIS_CACHE_SIZE = 256
+_analysis_cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# 子进程内复用的分块器，由 _init_worker 在进程启动时创建
+_worker_chunker: Optional["TextChunker"] = None
+
+def _init_worker(config: AppConfig):
+    global _worker_chunker
+    _worker_chunker = TextChunker(config)
+
+def _chunk_one(args) -> List[str]:
+    """子进程中对单个文档分块"""
+    text, strategy = args
+    return _worker_chunker.chunk_text(text, strategy)
 
 class TextChunker:
     """文本分块器，支持多种分块策略"""
@@ -32,13 +61,32 @@ class TextChunker:
         else:
             return self._recursive_chunk(text)  # 默认策略
     
-    def chunk_documents(self, documents: List[Document], strategy: str = "recursive") -> List[Document]:
-        """对文档列表进行分块"""
+    def chunk_documents(
+        self,
+        documents: List[Document],
+        strategy: str = "recursive",
+        workers: Optional[int] = None
+    ) -> List[Document]:
+        """对文档列表进行分块
+
+        workers 不为 None 时使用多进程并行分块（0 表示使用全部 CPU 核心）。
+        """
+        if workers is not None and len(documents) > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count(),
+                initializer=_init_worker,
+                initargs=(self.config,)
+            ) as executor:
+                all_chunks = list(executor.map(
+                    _chunk_one,
+                    ((doc.page_content, strategy) for doc in documents)
+                ))
+        else:
+            all_chunks = [self.chunk_text(doc.page_content, strategy) for doc in documents]
+        
         chunked_docs = []
         
-        for doc in documents:
-            chunks = self.chunk_text(doc.page_content, strategy)
-            
+        for doc, chunks in zip(documents, all_chunks):
             for i, chunk in enumerate(chunks):
                 # 创建新的文档，保留原始元数据并添加分块信息
                 chunk_metadata = doc.metadata.copy()
@@ -56,48 +104,58 @@ class TextChunker:
         
         return chunked_docs
     
-    def _recursive_chunk(self, text: str) -> List[str]:
-        """递归字符分块（推荐）"""
-        splitter = RecursiveCharacterTextSplitter(
+    @cached_property
+    def _recursive_splitter(self) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
             length_function=len,
             separators=["\n\n", "\n", "。", "！", "？", ";", ":", "，", " ", ""]
         )
-        return splitter.split_text(text)
     
-    def _character_chunk(self, text: str) -> List[str]:
-        """字符分块"""
-        splitter = CharacterTextSplitter(
+    @cached_property
+    def _character_splitter(self) -> CharacterTextSplitter:
+        return CharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
             separator="\n"
         )
-        return splitter.split_text(text)
     
-    def _token_chunk(self, text: str) -> List[str]:
-        """基于 Token 的分块"""
-        splitter = TokenTextSplitter(
+    @cached_property
+    def _token_splitter(self) -> TokenTextSplitter:
+        return TokenTextSplitter(
             chunk_size=self.chunk_size // 4,  # Token 通常比字符少
             chunk_overlap=self.chunk_overlap // 4
         )
-        return splitter.split_text(text)
     
-    def _markdown_chunk(self, text: str) -> List[str]:
-        """Markdown 结构化分块"""
+    @cached_property
+    def _markdown_splitter(self) -> MarkdownHeaderTextSplitter:
         headers_to_split_on = [
             ("#", "Header 1"),
             ("##", "Header 2"),
             ("###", "Header 3"),
             ("####", "Header 4"),
         ]
-        
-        markdown_splitter = MarkdownHeaderTextSplitter(
+        return MarkdownHeaderTextSplitter(
             headers_to_split_on=headers_to_split_on
         )
-        
+    
+    def _recursive_chunk(self, text: str) -> List[str]:
+        """递归字符分块（推荐）"""
+        return self._recursive_splitter.split_text(text)
+    
+    def _character_chunk(self, text: str) -> List[str]:
+        """字符分块"""
+        return self._character_splitter.split_text(text)
+    
+    def _token_chunk(self, text: str) -> List[str]:
+        """基于 Token 的分块"""
+        return self._token_splitter.split_text(text)
+    
+    def _markdown_chunk(self, text: str) -> List[str]:
+        """Markdown 结构化分块"""
         # 先按标题分块
-        md_header_splits = markdown_splitter.split_text(text)
+        md_header_splits = self._markdown_splitter.split_text(text)
         
         # 如果分块太大，再进行递归分块
         final_chunks = []
@@ -116,25 +174,28 @@ class TextChunker:
         sentences = self._split_sentences(text)
         
         chunks = []
-        current_chunk = ""
+        # 以片段列表累积当前块，避免字符串反复拼接
+        parts: List[str] = []
         current_size = 0
         
         for sentence in sentences:
             sentence_size = len(sentence)
             
             # 如果添加这个句子会超过限制，先保存当前块
-            if current_size + sentence_size > self.chunk_size and current_chunk:
+            if current_size + sentence_size > self.chunk_size and parts:
+                current_chunk = "".join(parts)
                 chunks.append(current_chunk.strip())
                 
                 # 计算重叠部分
                 overlap_text = self._get_overlap_text(current_chunk, self.chunk_overlap)
-                current_chunk = overlap_text + sentence
-                current_size = len(current_chunk)
+                parts = [overlap_text, sentence]
+                current_size = len(overlap_text) + sentence_size
             else:
-                current_chunk += sentence
+                parts.append(sentence)
                 current_size += sentence_size
         
         # 添加最后一个块
+        current_chunk = "".join(parts)
         if current_chunk.strip():
             chunks.append(current_chunk.strip())
         
@@ -142,27 +203,18 @@ class TextChunker:
     
     def _split_sentences(self, text: str) -> List[str]:
         """分割句子（支持中英文）"""
-        # 中文句子结束符
-        chinese_endings = r'[。！？；]'
-        # 英文句子结束符
-        english_endings = r'[.!?]'
-        
-        # 组合正则表达式
-        sentence_pattern = f'({chinese_endings}|{english_endings})\s*'
-        
-        sentences = re.split(sentence_pattern, text)
-        
-        # 重新组合句子和标点
+        # 单次扫描：每个句子为上一个边界到本次“结束符 + 空白”末尾的切片
         result = []
-        for i in range(0, len(sentences) - 1, 2):
-            if i + 1 < len(sentences):
-                sentence = sentences[i] + sentences[i + 1]
-                if sentence.strip():
-                    result.append(sentence)
+        start = 0
+        for match in _SENTENCE_BOUNDARY_PATTERN.finditer(text):
+            sentence = text[start:match.end()]
+            if sentence.strip():
+                result.append(sentence)
+            start = match.end()
         
         # 处理最后一个可能没有标点的句子
-        if len(sentences) % 2 == 1 and sentences[-1].strip():
-            result.append(sentences[-1])
+        if start < len(text) and text[start:].strip():
+            result.append(text[start:])
         
         return result
     
@@ -175,7 +227,7 @@ class TextChunker:
         overlap_text = text[-overlap_size:]
         
         # 找到第一个句子开始的位置
-        sentence_start = re.search(r'[。！？；.!?]\s*', overlap_text)
+        sentence_start = _SENTENCE_BOUNDARY_PATTERN.search(overlap_text)
         if sentence_start:
             return overlap_text[sentence_start.end():]
         
@@ -194,13 +246,20 @@ class TextChunker:
     
     def analyze_text_structure(self, text: str) -> Dict[str, Any]:
         """分析文本结构，帮助选择分块策略"""
+        key = (hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest(), len(text))
+        with _analysis_cache_lock:
+            cached = _analysis_cache.get(key)
+            if cached is not None:
+                _analysis_cache.move_to_end(key)
+                return dict(cached)
+        
         analysis = {
             "total_length": len(text),
             "line_count": len(text.split('\n')),
             "paragraph_count": len([p for p in text.split('\n\n') if p.strip()]),
-            "has_markdown_headers": bool(re.search(r'^#+\s', text, re.MULTILINE)),
-            "has_code_blocks": bool(re.search(r'```', text)),
-            "has_lists": bool(re.search(r'^\s*[-*+]\s', text, re.MULTILINE)),
+            "has_markdown_headers": bool(_MARKDOWN_HEADER_PATTERN.search(text)),
+            "has_code_blocks": bool(_CODE_BLOCK_PATTERN.search(text)),
+            "has_lists": bool(_LIST_ITEM_PATTERN.search(text)),
             "sentence_count": len(self._split_sentences(text)),
         }
         
@@ -214,4 +273,10 @@ class TextChunker:
         else:
             analysis["recommended_strategy"] = "character"
         
-        return analysis
\ No newline at end of file
+        with _analysis_cache_lock:
+            _analysis_cache[key] = analysis
+            _analysis_cache.move_to_end(key)
+            if len(_analysis_cache) > _ANALYSIS_CACHE_SIZE:
+                _analysis_cache.popitem(last=False)
+        
+        return dict(analysis)
\ No newline at end of file
@@ -1,8 +1,8 @@
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 import mimetypes
+from types import MappingProxyType
 from langchain_community.document_loaders import (
-    TextLoader,
     PyPDFLoader,
     Docx2txtLoader,
     CSVLoader,
@@ -11,21 +11,28 @@ from langchain_community.document_loaders import (
 from langchain_core.documents import Document
 import base64
 import io
+import os
+from concurrent.futures import ThreadPoolExecutor
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 
+try:
+    import fitz  # PyMuPDF，可选依赖，PDF 文本提取更快
+except ImportError:
+    fitz = None
+
 class DocumentLoader:
     """文档加载器，支持多种文件格式"""
     
-    def __init__(self):
-        self.supported_extensions = {
-            '.txt': self._load_text,
-            '.md': self._load_markdown,
-            '.pdf': self._load_pdf,
-            '.docx': self._load_docx,
-            '.doc': self._load_docx,
-            '.csv': self._load_csv,
-        }
+    # 扩展名 -> 加载方法名
+    _EXT_DISPATCH = MappingProxyType({
+        '.txt': '_load_text',
+        '.md': '_load_markdown',
+        '.pdf': '_load_pdf',
+        '.docx': '_load_docx',
+        '.doc': '_load_docx',
+        '.csv': '_load_csv',
+    })
     
     def load_from_path(self, file_path: str, metadata: Dict[str, Any] = None) -> List[Document]:
         """从文件路径加载文档"""
@@ -34,10 +41,10 @@ class DocumentLoader:
             raise FileNotFoundError(f"File not found: {file_path}")
         
         extension = path.suffix.lower()
-        if extension not in self.supported_extensions:
+        if extension not in self._EXT_DISPATCH:
             raise ValueError(f"Unsupported file type: {extension}")
         
-        loader_func = self.supported_extensions[extension]
+        loader_func = getattr(self, self._EXT_DISPATCH[extension])
         documents = loader_func(str(path))
         
         # 添加元数据
@@ -56,6 +63,16 @@ class DocumentLoader:
         
         return documents
     
+    def load_many(self, file_paths: List[str], metadata: Dict[str, Any] = None) -> List[Document]:
+        """并行加载多个文件，结果按输入路径顺序拼接"""
+        if len(file_paths) <= 1:
+            return [doc for path in file_paths for doc in self.load_from_path(path, metadata)]
+        
+        max_workers = min(32, (os.cpu_count() or 1) * 2, len(file_paths))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda path: self.load_from_path(path, metadata), file_paths)
+            return [doc for documents in results for doc in documents]
+    
     def load_from_text(self, text: str, metadata: Dict[str, Any] = None) -> List[Document]:
         """从文本字符串加载文档"""
         base_metadata = {
@@ -72,16 +89,18 @@ class DocumentLoader:
     def load_from_base64(self, base64_content: str, file_type: str, metadata: Dict[str, Any] = None) -> List[Document]:
         """从 base64 编码内容加载文档"""
         try:
-            # 解码 base64
-            content_bytes = base64.b64decode(base64_content)
+            metadata = metadata or {}
+            # 解码 base64（跳过字符集校验）
+            content_bytes = base64.b64decode(base64_content, validate=False)
             
             if file_type.lower() == 'pdf' or metadata.get('isPDF'):
                 return self._load_pdf_from_bytes(content_bytes, metadata)
             elif file_type.lower() in ['docx', 'doc']:
                 return self._load_docx_from_bytes(content_bytes, metadata)
             else:
-                # 尝试作为文本处理
-                text = content_bytes.decode('utf-8')
+                # 尝试作为文本处理，可通过 metadata["charset"] 指定编码
+                text = content_bytes.decode(metadata.get('charset', 'utf-8'), errors='ignore')
+                del content_bytes
                 return self.load_from_text(text, metadata)
         
         except Exception as e:
@@ -89,8 +108,8 @@ class DocumentLoader:
     
     def _load_text(self, file_path: str) -> List[Document]:
         """加载文本文件"""
-        loader = TextLoader(file_path, encoding='utf-8')
-        return loader.load()
+        text = Path(file_path).read_text(encoding='utf-8', errors='ignore')
+        return [Document(page_content=text, metadata={"source": file_path})]
     
     def _load_markdown(self, file_path: str) -> List[Document]:
         """加载 Markdown 文件"""
@@ -103,23 +122,39 @@ class DocumentLoader:
     
     def _load_pdf(self, file_path: str) -> List[Document]:
         """加载 PDF 文件"""
-        loader = PyPDFLoader(file_path)
-        return loader.load()
+        if fitz is None:
+            loader = PyPDFLoader(file_path)
+            return loader.load()
+        
+        with fitz.open(file_path) as pdf:
+            return [
+                Document(
+                    page_content=page.get_text("text"),
+                    metadata={"source": file_path, "page": page_num}
+                )
+                for page_num, page in enumerate(pdf)
+            ]
     
     def _load_pdf_from_bytes(self, content_bytes: bytes, metadata: Dict[str, Any] = None) -> List[Document]:
         """从字节流加载 PDF"""
         try:
-            # 使用 PyPDF2 直接处理字节流
-            pdf_file = io.BytesIO(content_bytes)
-            pdf_reader = PdfReader(pdf_file)
+            if fitz is not None:
+                # 在关闭文档前取出全部页面文本，释放 MuPDF 句柄与缓冲区
+                with fitz.open(stream=content_bytes, filetype="pdf") as pdf:
+                    total_pages = pdf.page_count
+                    pages = [page.get_text("text") for page in pdf]
+            else:
+                # 未安装 PyMuPDF 时使用 PyPDF2 直接处理字节流
+                pdf_reader = PdfReader(io.BytesIO(content_bytes))
+                total_pages = len(pdf_reader.pages)
+                pages = (page.extract_text() for page in pdf_reader.pages)
             
             documents = []
-            for page_num, page in enumerate(pdf_reader.pages):
-                text = page.extract_text()
+            for page_num, text in enumerate(pages):
                 if text.strip():  # 只添加非空页面
                     page_metadata = {
                         "page": page_num + 1,
-                        "total_pages": len(pdf_reader.pages),
+                        "total_pages": total_pages,
                         **(metadata or {})
                     }
                     documents.append(Document(
@@ -143,11 +178,8 @@ class DocumentLoader:
             docx_file = io.BytesIO(content_bytes)
             doc = DocxDocument(docx_file)
             
-            # 提取所有段落文本
-            text_content = []
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text_content.append(paragraph.text)
+            # 提取所有段落文本（paragraph.text 每次访问都会遍历 XML，只取一次）
+            text_content = [text for text in (p.text for p in doc.paragraphs) if text.strip()]
             
             full_text = '\n'.join(text_content)
             
@@ -169,12 +201,12 @@ class DocumentLoader:
     
     def get_supported_extensions(self) -> List[str]:
         """获取支持的文件扩展名"""
-        return list(self.supported_extensions.keys())
+        return list(self._EXT_DISPATCH)
     
     def is_supported(self, file_path: str) -> bool:
         """检查文件是否支持"""
         extension = Path(file_path).suffix.lower()
-        return extension in self.supported_extensions
+        return extension in self._EXT_DISPATCH
     
     def detect_file_type(self, file_path: str) -> Optional[str]:
         """检测文件类型"""
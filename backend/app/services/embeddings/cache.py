@@ -0,0 +1,144 @@
+from typing import List, Optional, Dict
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 缓存中向量的存储精度：嵌入已 L2 归一化，float16 的相对误差（约 1e-3）不影响检索排序，内存与磁盘占用减半
+CACHE_DTYPE = np.float16
+
+class CachedEmbeddings(Embeddings):
+    """带内容哈希 LRU 缓存的嵌入包装器，可选 SQLite 持久化
+
+    缓存向量以连续的 float16 数组保存，命中时再转换为列表返回。
+    """
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        model_name: str,
+        max_size: int = 10_000,
+        persist_path: Optional[str] = None
+    ):
+        self.inner = inner
+        self.model_name = model_name
+        self.max_size = max_size
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings_f16 (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    def _key(self, kind: str, text: str) -> bytes:
+        """缓存键：模型名 + 类型（文档/查询）+ 文本内容的哈希"""
+        return hashlib.blake2b(
+            f"{self.model_name}\0{kind}\0{text}".encode('utf-8'),
+            digest_size=32
+        ).digest()
+
+    def _get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """批量查询内存缓存，未命中的再查持久化存储"""
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                vec = self._cache.get(key)
+                if vec is not None:
+                    self._cache.move_to_end(key)
+                    found[key] = vec.tolist()
+
+            missing = [key for key in keys if key not in found]
+            if self._db is not None:
+                # 分段查询，避免超出 SQLite 单条语句的参数个数上限
+                for start in range(0, len(missing), 500):
+                    part = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = self._db.execute(
+                        f"SELECT hash, vec FROM embeddings_f16 WHERE hash IN ({placeholders})",
+                        part
+                    ).fetchall()
+                    for key, blob in rows:
+                        vec = np.frombuffer(blob, dtype=CACHE_DTYPE)
+                        found[key] = vec.tolist()
+                        self._cache_memory(key, vec)
+        return found
+
+    def _put_many(self, items: Dict[bytes, List[float]]):
+        with self._lock:
+            arrays = {key: np.asarray(vec, dtype=CACHE_DTYPE) for key, vec in items.items()}
+            for key, vec in arrays.items():
+                self._cache_memory(key, vec)
+            if self._db is not None and arrays:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings_f16 (hash, vec) VALUES (?, ?)",
+                    [(key, vec.tobytes()) for key, vec in arrays.items()]
+                )
+                self._db.commit()
+
+    def _cache_memory(self, key: bytes, vec: np.ndarray):
+        self._cache[key] = vec
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def _lookup_documents(self, texts: List[str]):
+        """返回（缓存键列表, 已命中向量, 去重后的未命中文本）"""
+        keys = [self._key("doc", text) for text in texts]
+        found = self._get_many(keys)
+
+        # 去重后的未命中文本，保持首次出现顺序
+        misses: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in misses:
+                misses[key] = text
+        return keys, found, misses
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """嵌入文档列表，仅对未命中缓存的文本调用底层模型"""
+        keys, found, misses = self._lookup_documents(texts)
+        if misses:
+            vectors = self.inner.embed_documents(list(misses.values()))
+            computed = dict(zip(misses.keys(), vectors))
+            self._put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步嵌入文档列表，未命中部分走底层模型的异步接口"""
+        keys, found, misses = self._lookup_documents(texts)
+        if misses:
+            vectors = await self.inner.aembed_documents(list(misses.values()))
+            computed = dict(zip(misses.keys(), vectors))
+            self._put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本"""
+        key = self._key("query", text)
+        found = self._get_many([key])
+        if key in found:
+            return found[key]
+
+        vec = self.inner.embed_query(text)
+        self._put_many({key: vec})
+        return vec
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询文本"""
+        key = self._key("query", text)
+        found = self._get_many([key])
+        if key in found:
+            return found[key]
+
+        vec = await self.inner.aembed_query(text)
+        self._put_many({key: vec})
+        return vec
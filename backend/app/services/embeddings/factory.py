@@ -1,24 +1,35 @@
-from typing import Optional
+from typing import Optional, Dict
 from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from ..config import AppConfig
+from .cache import CachedEmbeddings
+from .provider import configure_torch_threads
+import os
+import threading
 
 class EmbeddingFactory:
     """嵌入模型工厂类"""
     
     def __init__(self, config: AppConfig):
         self.config = config
-        self._embeddings: Optional[Embeddings] = None
+        self._embeddings: Dict[str, Embeddings] = {}
+        self._lock = threading.Lock()
     
     def get_embeddings(self, provider: Optional[str] = None) -> Embeddings:
         """获取嵌入模型实例"""
         provider = provider or self.config.embedding_provider
         
-        if self._embeddings is None:
-            self._embeddings = self._create_embeddings(provider)
+        if provider in self._embeddings:
+            return self._embeddings[provider]
         
-        return self._embeddings
+        # 加锁避免并发请求重复加载同一模型
+        with self._lock:
+            if provider not in self._embeddings:
+                self._embeddings[provider] = self._wrap_with_cache(
+                    self._create_embeddings(provider), provider
+                )
+            return self._embeddings[provider]
     
     def _create_embeddings(self, provider: str) -> Embeddings:
         """创建嵌入模型实例"""
@@ -27,11 +38,12 @@ class EmbeddingFactory:
                 model=self.config.embedding_model,
                 openai_api_key=self.config.openai_embed_api_key,
                 openai_api_base=self.config.openai_embed_base_url,
-                chunk_size=1000,
+                chunk_size=2048,  # OpenAI 单次请求最多 2048 条输入
                 max_retries=3
             )
         
         elif provider == "hf" or provider == "huggingface":
+            configure_torch_threads()
             return HuggingFaceEmbeddings(
                 model_name=self.config.hf_embedding_model,
                 model_kwargs={'device': 'cpu'},
@@ -41,6 +53,27 @@ class EmbeddingFactory:
         else:
             raise ValueError(f"Unsupported embedding provider: {provider}")
     
+    def _wrap_with_cache(self, embeddings: Embeddings, provider: str) -> Embeddings:
+        """为嵌入模型添加内容哈希缓存"""
+        if self.config.embedding_cache_size <= 0:
+            return embeddings
+        
+        if provider == "openai":
+            model_name = self.config.embedding_model
+        else:
+            model_name = self.config.hf_embedding_model
+        
+        persist_path = self.config.embedding_cache_path or None
+        if persist_path:
+            os.makedirs(os.path.dirname(persist_path) or ".", exist_ok=True)
+        
+        return CachedEmbeddings(
+            embeddings,
+            model_name=f"{provider}:{model_name}",
+            max_size=self.config.embedding_cache_size,
+            persist_path=persist_path
+        )
+    
     def get_available_providers(self) -> list[str]:
         """获取可用的嵌入提供方列表"""
         available = []
@@ -57,9 +90,12 @@ class EmbeddingFactory:
     def test_embeddings(self, provider: str) -> bool:
         """测试嵌入模型是否可用"""
         try:
-            embeddings = self._create_embeddings(provider)
-            # 简单测试
-            test_result = embeddings.embed_query("test")
+            # 复用已加载的模型；绕过嵌入缓存，确保真正请求一次底层模型
+            embeddings = self.get_embeddings(provider)
+            if isinstance(embeddings, CachedEmbeddings):
+                embeddings = embeddings.inner
+            # 嵌入接口没有免费的探活接口，用单个 token 的输入测试
+            test_result = embeddings.embed_query("a")
             return len(test_result) > 0
         except Exception as e:
             print(f"Error testing embeddings for provider {provider}: {e}")
@@ -1,10 +1,76 @@
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import httpx
 import openai
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import hashlib
 import json
+import os
+import numpy as np
 from langchain_core.embeddings import Embeddings
 
+# OpenAI embeddings 接口单次请求的输入条数与 token 总量上限
+OPENAI_MAX_BATCH_SIZE = 2048
+OPENAI_MAX_BATCH_TOKENS = 300_000
+# DeepSeek 单次请求的输入条数
+DEEPSEEK_BATCH_SIZE = 256
+# 并发发出的嵌入请求数上限
+EMBEDDING_MAX_CONCURRENCY = 8
+
+# CPU 上本地嵌入模型使用的线程数；需在导入 torch 之前设置 OMP/MKL 线程数才会生效
+EMBED_NUM_THREADS = int(os.environ.get("EMBED_NUM_THREADS", os.cpu_count() or 4))
+os.environ.setdefault("OMP_NUM_THREADS", str(EMBED_NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(EMBED_NUM_THREADS))
+
+@lru_cache(maxsize=None)
+def configure_torch_threads() -> None:
+    """设置 PyTorch 线程数（每个进程只执行一次）
+
+    算子内并行线程数设为 EMBED_NUM_THREADS，算子间并行设为 1：嵌入推理是单路计算密集型负载，
+    多路算子间并行只会与算子内线程争抢核心。与其他 CPU 密集服务同机部署时应调低 EMBED_NUM_THREADS。
+    """
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(EMBED_NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 已有并行任务运行后不允许再修改
+        pass
+
+def _embed_batches_concurrently(
+    embed_batch: Callable[[List[str]], List[List[float]]],
+    batches: List[List[str]]
+) -> List[List[float]]:
+    """并发请求各子批次的嵌入，结果按原顺序拼接"""
+    if len(batches) <= 1:
+        return embed_batch(batches[0]) if batches else []
+    
+    with ThreadPoolExecutor(max_workers=min(EMBEDDING_MAX_CONCURRENCY, len(batches))) as executor:
+        results = executor.map(embed_batch, batches)
+        return [vector for batch_vectors in results for vector in batch_vectors]
+
+# 进程内共享的 HTTP 会话：复用连接（keep-alive），并对限流与服务端错误自动重试
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=max(16, EMBEDDING_MAX_CONCURRENCY * 2),
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None
+    )
+))
+
 class BaseEmbeddingProvider(Embeddings, ABC):
     """嵌入提供者基类"""
     
@@ -27,16 +93,57 @@ class OpenAIEmbeddingProvider(BaseEmbeddingProvider):
     
     def __init__(self, api_key: str, model_name: str = "text-embedding-ada-002", **kwargs):
         super().__init__(model_name, **kwargs)
-        self.client = openai.OpenAI(api_key=api_key)
+        # 长连接 + HTTP/2，避免每个批次重新握手
+        self.client = openai.OpenAI(
+            api_key=api_key,
+            http_client=httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=16, keepalive_expiry=60)
+            )
+        )
+    
+    def _token_counter(self):
+        """返回计算文本 token 数的函数"""
+        try:
+            import tiktoken
+            try:
+                encoding = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(encoding.encode(text))
+        except ImportError:
+            # 未安装 tiktoken 时按字符数粗略估计（偏保守）
+            return len
+    
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        """按条数与 token 总量上限切分请求批次"""
+        count_tokens = self._token_counter()
+        batches: List[List[str]] = []
+        batch: List[str] = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (len(batch) >= OPENAI_MAX_BATCH_SIZE or batch_tokens + tokens > OPENAI_MAX_BATCH_TOKENS):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(
+            model=self.model_name,
+            input=batch
+        )
+        return [item.embedding for item in response.data]
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """嵌入文档列表"""
         try:
-            response = self.client.embeddings.create(
-                model=self.model_name,
-                input=texts
-            )
-            return [item.embedding for item in response.data]
+            return _embed_batches_concurrently(self._embed_batch, self._split_batches(texts))
         except Exception as e:
             print(f"OpenAI embedding error: {e}")
             raise
@@ -60,23 +167,26 @@ class DeepSeekEmbeddingProvider(BaseEmbeddingProvider):
         super().__init__(model_name, **kwargs)
         self.api_key = api_key
         self.base_url = kwargs.get('base_url', 'https://api.deepseek.com/v1')
+        # 异步请求客户端（HTTP/2 多路复用），首次异步调用时在当前事件循环中创建
+        self._async_client: Optional[httpx.AsyncClient] = None
     
-    def _make_request(self, texts: List[str]) -> List[List[float]]:
-        """发送嵌入请求"""
-        headers = {
+    def _headers(self) -> Dict[str, str]:
+        return {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json'
         }
-        
+    
+    def _make_request(self, texts: List[str]) -> List[List[float]]:
+        """发送嵌入请求"""
         data = {
             'model': self.model_name,
             'input': texts
         }
         
         try:
-            response = requests.post(
+            response = _SESSION.post(
                 f'{self.base_url}/embeddings',
-                headers=headers,
+                headers=self._headers(),
                 json=data,
                 timeout=30
             )
@@ -89,29 +199,139 @@ class DeepSeekEmbeddingProvider(BaseEmbeddingProvider):
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """嵌入文档列表"""
-        return self._make_request(texts)
+        batches = [texts[i:i + DEEPSEEK_BATCH_SIZE] for i in range(0, len(texts), DEEPSEEK_BATCH_SIZE)]
+        return _embed_batches_concurrently(self._make_request, batches)
     
     def embed_query(self, text: str) -> List[float]:
         """嵌入查询文本"""
         result = self._make_request([text])
         return result[0]
+    
+    async def _amake_request(self, texts: List[str]) -> List[List[float]]:
+        """异步发送嵌入请求"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                http2=True,
+                timeout=30,
+                limits=httpx.Limits(max_connections=EMBEDDING_MAX_CONCURRENCY)
+            )
+        
+        try:
+            response = await self._async_client.post(
+                f'{self.base_url}/embeddings',
+                headers=self._headers(),
+                json={'model': self.model_name, 'input': texts}
+            )
+            response.raise_for_status()
+            return [item['embedding'] for item in response.json()['data']]
+        except Exception as e:
+            print(f"DeepSeek embedding error: {e}")
+            raise
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步嵌入文档列表，各子批次并发请求"""
+        batches = [texts[i:i + DEEPSEEK_BATCH_SIZE] for i in range(0, len(texts), DEEPSEEK_BATCH_SIZE)]
+        semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+        
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await self._amake_request(batch)
+        
+        results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+        return [vector for batch_vectors in results for vector in batch_vectors]
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步嵌入查询文本"""
+        result = await self._amake_request([text])
+        return result[0]
 
 class HuggingFaceEmbeddingProvider(BaseEmbeddingProvider):
-    """HuggingFace 嵌入提供者"""
+    """HuggingFace 嵌入提供者
+
+    backend="onnx" 时将模型导出为 ONNX 并做 int8 动态量化，使用 onnxruntime 在 CPU 上推理；
+    可通过 pooling（mean | cls）指定池化方式，onnx_dir 指定量化模型缓存目录。
+    """
     
     def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", **kwargs):
         super().__init__(model_name, **kwargs)
+        self.backend = kwargs.get('backend', 'torch')
+        if self.backend == "onnx":
+            self._load_onnx_model()
+            return
+        
         try:
             from sentence_transformers import SentenceTransformer
+            configure_torch_threads()
             self.model = SentenceTransformer(model_name)
         except ImportError:
             raise ImportError("Please install sentence-transformers: pip install sentence-transformers")
     
+    def _load_onnx_model(self):
+        """导出并量化 ONNX 模型（已存在时直接加载）"""
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            from transformers import AutoTokenizer
+        except ImportError:
+            raise ImportError("Please install optimum with onnxruntime: pip install optimum[onnxruntime]")
+        
+        onnx_dir = Path(self.config.get('onnx_dir') or Path("app/storage/onnx") / self.model_name.replace("/", "__"))
+        quantized_file = onnx_dir / "model_quantized.onnx"
+        if not quantized_file.exists():
+            exported = ORTModelForFeatureExtraction.from_pretrained(
+                self.model_name, export=True, provider="CPUExecutionProvider"
+            )
+            quantizer = ORTQuantizer.from_pretrained(exported)
+            quantizer.quantize(
+                save_dir=onnx_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.onnx_model = ORTModelForFeatureExtraction.from_pretrained(
+            onnx_dir, file_name=quantized_file.name, provider="CPUExecutionProvider"
+        )
+    
+    def _onnx_encode(self, texts: List[str]) -> np.ndarray:
+        """分词 -> ONNX 推理 -> 池化 -> L2 归一化"""
+        batch_size = self.config.get('batch_size', 64)
+        pooling = self.config.get('pooling', 'mean')
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                return_tensors="np"
+            )
+            hidden = self.onnx_model(**inputs).last_hidden_state
+            if pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled / norms)
+        return np.vstack(outputs)
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if self.backend == "onnx":
+            return self._onnx_encode(texts)
+        # encode 内部会按文本长度排序后分批，减少 padding；显式指定批大小以免走默认值
+        return self.model.encode(
+            texts,
+            batch_size=self.config.get('batch_size', 64),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """嵌入文档列表"""
         try:
-            embeddings = self.model.encode(texts)
-            return embeddings.tolist()
+            if not texts:
+                return []
+            return self._encode(texts).tolist()
         except Exception as e:
             print(f"HuggingFace embedding error: {e}")
             raise
@@ -119,7 +339,7 @@ class HuggingFaceEmbeddingProvider(BaseEmbeddingProvider):
     def embed_query(self, text: str) -> List[float]:
         """嵌入查询文本"""
         try:
-            embedding = self.model.encode([text])
+            embedding = self._encode([text])
             return embedding[0].tolist()
         except Exception as e:
             print(f"HuggingFace embedding error: {e}")
@@ -137,6 +357,7 @@ class LocalEmbeddingProvider(BaseEmbeddingProvider):
         """加载本地模型"""
         try:
             from sentence_transformers import SentenceTransformer
+            configure_torch_threads()
             self.model = SentenceTransformer(self.model_path)
         except ImportError:
             raise ImportError("Please install sentence-transformers: pip install sentence-transformers")
@@ -147,7 +368,7 @@ class LocalEmbeddingProvider(BaseEmbeddingProvider):
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """嵌入文档列表"""
         try:
-            embeddings = self.model.encode(texts)
+            embeddings = self.model.encode(texts, normalize_embeddings=True)
             return embeddings.tolist()
         except Exception as e:
             print(f"Local embedding error: {e}")
@@ -156,7 +377,7 @@ class LocalEmbeddingProvider(BaseEmbeddingProvider):
     def embed_query(self, text: str) -> List[float]:
         """嵌入查询文本"""
         try:
-            embedding = self.model.encode([text])
+            embedding = self.model.encode([text], normalize_embeddings=True)
             return embedding[0].tolist()
         except Exception as e:
             print(f"Local embedding error: {e}")
@@ -169,19 +390,18 @@ class MockEmbeddingProvider(BaseEmbeddingProvider):
         super().__init__("mock-embedding", **kwargs)
         self.dimension = dimension
     
+    def _embed(self, text: str) -> np.ndarray:
+        # 基于文本内容生成确定性的随机嵌入（blake2b 种子跨进程、跨平台稳定）
+        seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+        vec = np.random.default_rng(seed).random(self.dimension, dtype=np.float32)
+        return vec / np.linalg.norm(vec)
+    
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """生成模拟嵌入"""
-        import random
-        embeddings = []
-        for text in texts:
-            # 基于文本内容生成确定性的随机嵌入
-            random.seed(hash(text) % (2**32))
-            embedding = [random.random() for _ in range(self.dimension)]
-            embeddings.append(embedding)
-        return embeddings
+        if not texts:
+            return []
+        return np.stack([self._embed(text) for text in texts]).tolist()
     
     def embed_query(self, text: str) -> List[float]:
         """生成模拟查询嵌入"""
-        import random
-        random.seed(hash(text) % (2**32))
-        return [random.random() for _ in range(self.dimension)]
\ No newline at end of file
+        return self._embed(text).tolist()
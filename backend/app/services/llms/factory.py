@@ -1,8 +1,14 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from langchain_core.language_models import BaseLanguageModel
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from ..config import AppConfig
+import requests
+
+# 健康检查只请求模型列表接口，不触发生成
+HEALTH_CHECK_TIMEOUT = 2
+GEMINI_MODELS_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+_HEALTH_SESSION = requests.Session()
 
 class LLMFactory:
     """LLM 工厂类，支持多提供方"""
@@ -78,12 +84,38 @@ class LLMFactory:
         
         return available
     
+    def _openai_compatible_endpoint(self, provider: str) -> Optional[Tuple[str, str]]:
+        """OpenAI 兼容提供方的 (base_url, api_key)"""
+        endpoints = {
+            "openai": (self.config.openai_base_url, self.config.openai_api_key),
+            "deepseek": (self.config.deepseek_base_url, self.config.deepseek_api_key),
+            "doubao": (self.config.doubao_base_url, self.config.doubao_api_key),
+        }
+        return endpoints.get(provider)
+    
     def test_provider(self, provider: str) -> bool:
-        """测试提供方是否可用"""
+        """测试提供方是否可用（请求模型列表接口，不消耗 token）"""
         try:
-            llm = self.get_llm(provider)
-            # 简单测试调用
-            response = llm.invoke("Hello")
-            return bool(response.content)
+            endpoint = self._openai_compatible_endpoint(provider)
+            if endpoint is not None:
+                base_url, api_key = endpoint
+                response = _HEALTH_SESSION.get(
+                    f"{base_url.rstrip('/')}/models",
+                    headers={"Authorization": f"Bearer {api_key}"},
+                    timeout=HEALTH_CHECK_TIMEOUT
+                )
+            elif provider == "gemini":
+                response = _HEALTH_SESSION.get(
+                    GEMINI_MODELS_URL,
+                    params={"key": self.config.gemini_api_key},
+                    timeout=HEALTH_CHECK_TIMEOUT
+                )
+            else:
+                return False
+            
+            if response.status_code in (404, 405):
+                # 部分兼容接口未提供模型列表，退回到一次最小的生成调用
+                return bool(self.get_llm(provider).invoke("Hello").content)
+            return response.ok
         except Exception:
             return False
\ No newline at end of file
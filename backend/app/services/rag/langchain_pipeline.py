@@ -1,16 +1,38 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import Runnable
 from langchain_core.documents import Document
 from ..llms.factory import LLMFactory
 from ..embeddings.factory import EmbeddingFactory
 from ..vectorstores.factory import VectorStoreFactory
 from ..retrievers.factory import RetrieverFactory
 from ..config import AppConfig
-from .prompts import RAGPrompts
+from .prompts import RAG_PROMPTS
+from .semantic_cache import SemanticCache, get_semantic_cache
+import asyncio
+import re
+import threading
 import time
 
+# 指代词：问题中出现时需要结合历史记录重写（中文字符间没有词边界，单独匹配）
+_PRONOUN_PATTERN = re.compile(r"\b(?:it|its|this|that|these|those|they|them|he|she)\b|[这那它他她]", re.I)
+# 足够长且不含指代词的问题视为自包含，无需重写
+_SELF_CONTAINED_MIN_WORDS = 8
+_REWRITE_CACHE_SIZE = 256
+
+# 上下文中单个文档的格式
+_format_context_entry = "[文档{}] 来源: {}\n{}".format
+# 摘要模式下来源内容预览的字符数
+SOURCE_PREVIEW_CHARS = 200
+
+def _needs_rewrite(question: str, chat_history: Optional[List[Dict[str, str]]]) -> bool:
+    """判断问题是否需要结合历史记录重写"""
+    if not chat_history:
+        return False
+    return len(question.split()) < _SELF_CONTAINED_MIN_WORDS or bool(_PRONOUN_PATTERN.search(question))
+
 class LangChainRAGPipeline:
     """基于 LangChain 的 RAG 管道"""
     
@@ -20,7 +42,25 @@ class LangChainRAGPipeline:
         self.embedding_factory = EmbeddingFactory(config)
         self.vector_store_factory = VectorStoreFactory(config)
         self.retriever_factory = RetrieverFactory(config)
-        self.prompts = RAGPrompts()
+        self.prompts = RAG_PROMPTS
+        self._prompt_templates = {
+            "qa": self.prompts.get_qa_prompt(),
+            "conversational_qa": self.prompts.get_conversational_qa_prompt(),
+            "question_rewrite": self.prompts.get_question_rewrite_prompt(),
+        }
+        self._chains: Dict[Tuple[str, str], Runnable] = {}
+        # 问题重写结果缓存：（最近 3 轮历史, 问题, 提供方）-> 重写后的问题
+        self._rewrite_cache: "OrderedDict[Tuple[int, str, str], str]" = OrderedDict()
+        self._rewrite_cache_lock = threading.Lock()
+        
+        # 语义查询缓存（条目数为 0 表示关闭），进程内各流水线共享
+        self.semantic_cache: Optional[SemanticCache] = None
+        if config.semantic_cache_size > 0:
+            self.semantic_cache = get_semantic_cache(
+                threshold=config.semantic_cache_threshold,
+                ttl=config.semantic_cache_ttl,
+                max_entries=config.semantic_cache_size
+            )
         
         # 当前活跃的提供方
         self.current_provider = config.llm_provider
@@ -30,18 +70,37 @@ class LangChainRAGPipeline:
         question: str, 
         notebook_id: str, 
         top_k: int = 5,
-        provider: Optional[str] = None
+        provider: Optional[str] = None,
+        do_not_cache: bool = False,
+        sources_summary_only: bool = False
     ) -> Dict[str, Any]:
-        """执行 RAG 查询"""
+        """执行 RAG 查询
+
+        do_not_cache 为 True 时既不读取也不写入语义缓存（用于敏感问题）；
+        sources_summary_only 为 True 时来源只返回出处、得分与内容预览。
+        """
         start_time = time.time()
         
         try:
             # 使用指定的提供方或当前活跃的提供方
             llm_provider = provider or self.current_provider
+            embeddings = self.embedding_factory.get_embeddings()
+            
+            # 语义缓存：相近的问题直接复用已有回答
+            cache_namespace = (notebook_id, llm_provider, top_k, sources_summary_only)
+            question_vector = None
+            if self.semantic_cache is not None and not do_not_cache:
+                question_vector = embeddings.embed_query(question)
+                cached = self.semantic_cache.lookup(cache_namespace, question_vector)
+                if cached is not None:
+                    cached["question"] = question
+                    cached["meta"].update({
+                        "cache_hit": True,
+                        "total_time": time.time() - start_time
+                    })
+                    return cached
             
             # 获取组件
-            llm = self.llm_factory.get_llm(llm_provider)
-            embeddings = self.embedding_factory.get_embeddings()
             vector_store = self.vector_store_factory.get_vector_store(
                 collection_name=f"notebook_{notebook_id}",
                 embeddings=embeddings
@@ -72,29 +131,18 @@ class LangChainRAGPipeline:
             # 构建上下文
             context = self._format_context(relevant_docs)
             
-            # 创建提示模板
-            prompt = self.prompts.get_qa_prompt()
-            
-            # 构建 RAG 链
-            rag_chain = (
-                {
-                    "context": lambda x: context,
-                    "question": RunnablePassthrough()
-                }
-                | prompt
-                | llm
-                | StrOutputParser()
-            )
+            # 获取（缓存的）RAG 链
+            rag_chain = self._get_chain("qa", llm_provider)
             
             # 执行查询
             retrieval_time = time.time() - start_time
-            answer = rag_chain.invoke(question)
+            answer = rag_chain.invoke({"context": context, "question": question})
             total_time = time.time() - start_time
             
             # 格式化源文档
-            sources = self._format_sources(relevant_docs)
+            sources = self._format_sources(relevant_docs, summary_only=sources_summary_only)
             
-            return {
+            result = {
                 "question": question,
                 "answer": answer,
                 "sources": sources,
@@ -108,6 +156,11 @@ class LangChainRAGPipeline:
                 }
             }
             
+            if question_vector is not None:
+                self.semantic_cache.add(cache_namespace, question_vector, result)
+            
+            return result
+            
         except Exception as e:
             return {
                 "question": question,
@@ -133,7 +186,6 @@ class LangChainRAGPipeline:
         
         try:
             llm_provider = provider or self.current_provider
-            llm = self.llm_factory.get_llm(llm_provider)
             embeddings = self.embedding_factory.get_embeddings()
             vector_store = self.vector_store_factory.get_vector_store(
                 collection_name=f"notebook_{notebook_id}",
@@ -148,7 +200,7 @@ class LangChainRAGPipeline:
             
             # 如果有历史记录，重写问题以包含上下文
             if chat_history:
-                question = self._rewrite_question_with_history(question, chat_history, llm)
+                question = self._rewrite_question_with_history(question, chat_history, llm_provider)
             
             # 检索相关文档
             relevant_docs = retriever.get_relevant_documents(question)
@@ -159,27 +211,19 @@ class LangChainRAGPipeline:
             # 构建上下文
             context = self._format_context(relevant_docs)
             
-            # 创建带历史记录的提示模板
-            prompt = self.prompts.get_conversational_qa_prompt()
-            
             # 格式化历史记录
             history_text = self._format_chat_history(chat_history or [])
             
-            # 构建 RAG 链
-            rag_chain = (
-                {
-                    "context": lambda x: context,
-                    "chat_history": lambda x: history_text,
-                    "question": RunnablePassthrough()
-                }
-                | prompt
-                | llm
-                | StrOutputParser()
-            )
+            # 获取（缓存的）带历史记录的 RAG 链
+            rag_chain = self._get_chain("conversational_qa", llm_provider)
             
             # 执行查询
             retrieval_time = time.time() - start_time
-            answer = rag_chain.invoke(question)
+            answer = rag_chain.invoke({
+                "context": context,
+                "chat_history": history_text,
+                "question": question
+            })
             total_time = time.time() - start_time
             
             # 格式化源文档
@@ -212,36 +256,187 @@ class LangChainRAGPipeline:
                 }
             }
     
+    async def aquery(
+        self,
+        question: str,
+        notebook_id: str,
+        top_k: int = 5,
+        provider: Optional[str] = None,
+        do_not_cache: bool = False,
+        sources_summary_only: bool = False
+    ) -> Dict[str, Any]:
+        """异步执行 RAG 查询，多个并发请求共享同一事件循环"""
+        start_time = time.time()
+        
+        try:
+            llm_provider = provider or self.current_provider
+            embeddings = self.embedding_factory.get_embeddings()
+            use_cache = self.semantic_cache is not None and not do_not_cache
+            
+            # 问题嵌入（语义缓存查询）与检索器构建并行进行；
+            # 嵌入经缓存包装，检索时不会重复计算同一问题的向量
+            question_vector, retriever = await asyncio.gather(
+                embeddings.aembed_query(question) if use_cache else asyncio.sleep(0),
+                asyncio.to_thread(self._create_retriever, notebook_id, embeddings, top_k)
+            )
+            
+            cache_namespace = (notebook_id, llm_provider, top_k, sources_summary_only)
+            if question_vector is not None:
+                cached = self.semantic_cache.lookup(cache_namespace, question_vector)
+                if cached is not None:
+                    cached["question"] = question
+                    cached["meta"].update({
+                        "cache_hit": True,
+                        "total_time": time.time() - start_time
+                    })
+                    return cached
+            
+            relevant_docs = await retriever.aget_relevant_documents(question)
+            if not relevant_docs:
+                return self._empty_response(question, llm_provider, start_time)
+            
+            context = self._format_context(relevant_docs)
+            rag_chain = self._get_chain("qa", llm_provider)
+            
+            retrieval_time = time.time() - start_time
+            answer = await rag_chain.ainvoke({"context": context, "question": question})
+            total_time = time.time() - start_time
+            
+            result = {
+                "question": question,
+                "answer": answer,
+                "sources": self._format_sources(relevant_docs, summary_only=sources_summary_only),
+                "meta": {
+                    "provider": llm_provider,
+                    "retrieval_time": retrieval_time,
+                    "generation_time": total_time - retrieval_time,
+                    "total_time": total_time,
+                    "retrieved_docs": len(relevant_docs),
+                    "context_length": len(context)
+                }
+            }
+            
+            if question_vector is not None:
+                self.semantic_cache.add(cache_namespace, question_vector, result)
+            
+            return result
+        
+        except Exception as e:
+            return self._error_response(question, provider, e, start_time)
+    
+    async def aquery_with_history(
+        self,
+        question: str,
+        notebook_id: str,
+        chat_history: List[Dict[str, str]] = None,
+        top_k: int = 5,
+        provider: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """异步执行带历史记录的查询"""
+        start_time = time.time()
+        
+        try:
+            llm_provider = provider or self.current_provider
+            embeddings = self.embedding_factory.get_embeddings()
+            
+            # 问题重写（LLM 调用）与检索器构建并行进行
+            rewritten, retriever = await asyncio.gather(
+                self._arewrite_question_with_history(question, chat_history, llm_provider),
+                asyncio.to_thread(self._create_retriever, notebook_id, embeddings, top_k)
+            )
+            question = rewritten
+            
+            relevant_docs = await retriever.aget_relevant_documents(question)
+            if not relevant_docs:
+                return self._empty_response(question, llm_provider, start_time)
+            
+            context = self._format_context(relevant_docs)
+            history_text = self._format_chat_history(chat_history or [])
+            rag_chain = self._get_chain("conversational_qa", llm_provider)
+            
+            retrieval_time = time.time() - start_time
+            answer = await rag_chain.ainvoke({
+                "context": context,
+                "chat_history": history_text,
+                "question": question
+            })
+            total_time = time.time() - start_time
+            
+            return {
+                "question": question,
+                "answer": answer,
+                "sources": self._format_sources(relevant_docs),
+                "meta": {
+                    "provider": llm_provider,
+                    "retrieval_time": retrieval_time,
+                    "generation_time": total_time - retrieval_time,
+                    "total_time": total_time,
+                    "retrieved_docs": len(relevant_docs),
+                    "context_length": len(context),
+                    "has_history": bool(chat_history)
+                }
+            }
+        
+        except Exception as e:
+            return self._error_response(question, provider, e, start_time)
+    
     def set_provider(self, provider: str) -> bool:
         """设置当前 LLM 提供方"""
-        try:
-            # 测试提供方是否可用
-            llm = self.llm_factory.get_llm(provider)
-            # 简单测试
-            test_response = llm.invoke("Hello")
-            if test_response.content:
-                self.current_provider = provider
-                return True
-            return False
-        except Exception:
-            return False
+        if provider == self.current_provider:
+            return True
+        
+        # 测试提供方是否可用
+        if self.llm_factory.test_provider(provider):
+            self.current_provider = provider
+            return True
+        return False
     
     def get_available_providers(self) -> List[str]:
         """获取可用的 LLM 提供方"""
         return self.llm_factory.get_available_providers()
     
+    def _get_chain(self, kind: str, provider: str) -> Runnable:
+        """获取 prompt | llm | 输出解析 链，按（模板类型, 提供方）缓存复用"""
+        key = (kind, provider)
+        chain = self._chains.get(key)
+        if chain is None:
+            chain = self._prompt_templates[kind] | self.llm_factory.get_llm(provider) | StrOutputParser()
+            self._chains[key] = chain
+        return chain
+    
+    def _create_retriever(self, notebook_id: str, embeddings, top_k: int):
+        """构建笔记本集合上的检索器"""
+        vector_store = self.vector_store_factory.get_vector_store(
+            collection_name=f"notebook_{notebook_id}",
+            embeddings=embeddings
+        )
+        return self.retriever_factory.create_retriever(
+            vector_store=vector_store,
+            search_kwargs={"k": top_k}
+        )
+    
     def _format_context(self, documents: List[Document]) -> str:
         """格式化上下文文档"""
-        context_parts = []
-        for i, doc in enumerate(documents, 1):
-            source = doc.metadata.get('source', 'Unknown')
-            content = doc.page_content.strip()
-            context_parts.append(f"[文档{i}] 来源: {source}\n{content}")
-        
-        return "\n\n".join(context_parts)
+        return "\n\n".join(
+            _format_context_entry(i, doc.metadata.get('source', 'Unknown'), doc.page_content.strip())
+            for i, doc in enumerate(documents, 1)
+        )
     
-    def _format_sources(self, documents: List[Document]) -> List[Dict[str, Any]]:
-        """格式化源文档信息"""
+    def _format_sources(self, documents: List[Document], summary_only: bool = False) -> List[Dict[str, Any]]:
+        """格式化源文档信息
+
+        summary_only 为 True 时不返回全文，只返回出处、得分和前 200 字预览。
+        """
+        if summary_only:
+            return [
+                {
+                    "source": doc.metadata.get('source', 'Unknown'),
+                    "score": doc.metadata.get('score', 0.0),
+                    "preview": doc.page_content[:SOURCE_PREVIEW_CHARS]
+                }
+                for doc in documents
+            ]
+        
         sources = []
         for doc in documents:
             source_info = {
@@ -270,28 +465,76 @@ class LangChainRAGPipeline:
         self, 
         question: str, 
         chat_history: List[Dict[str, str]], 
-        llm
+        llm_provider: str
     ) -> str:
         """基于历史记录重写问题"""
-        if not chat_history:
+        if not _needs_rewrite(question, chat_history):
             return question
         
+        key = self._rewrite_cache_key(question, chat_history, llm_provider)
+        cached = self._get_cached_rewrite(key)
+        if cached is not None:
+            return cached
+        
         try:
             history_text = self._format_chat_history(chat_history)
-            rewrite_prompt = self.prompts.get_question_rewrite_prompt()
+            rewrite_chain = self._get_chain("question_rewrite", llm_provider)
             
-            rewrite_chain = (
-                {
-                    "chat_history": lambda x: history_text,
-                    "question": RunnablePassthrough()
-                }
-                | rewrite_prompt
-                | llm
-                | StrOutputParser()
-            )
+            rewritten = rewrite_chain.invoke({"chat_history": history_text, "question": question}).strip()
+            self._cache_rewrite(key, rewritten)
+            return rewritten
+        
+        except Exception:
+            # 如果重写失败，返回原问题
+            return question
+    
+    def _rewrite_cache_key(
+        self,
+        question: str,
+        chat_history: List[Dict[str, str]],
+        llm_provider: str
+    ) -> Tuple[int, str, str]:
+        recent_turns = tuple(
+            (entry.get("question", ""), entry.get("answer", "")) for entry in chat_history[-3:]
+        )
+        return hash(recent_turns), question, llm_provider
+    
+    def _get_cached_rewrite(self, key: Tuple[int, str, str]) -> Optional[str]:
+        with self._rewrite_cache_lock:
+            rewritten = self._rewrite_cache.get(key)
+            if rewritten is not None:
+                self._rewrite_cache.move_to_end(key)
+            return rewritten
+    
+    def _cache_rewrite(self, key: Tuple[int, str, str], rewritten: str):
+        with self._rewrite_cache_lock:
+            self._rewrite_cache[key] = rewritten
+            self._rewrite_cache.move_to_end(key)
+            if len(self._rewrite_cache) > _REWRITE_CACHE_SIZE:
+                self._rewrite_cache.popitem(last=False)
+    
+    async def _arewrite_question_with_history(
+        self,
+        question: str,
+        chat_history: Optional[List[Dict[str, str]]],
+        llm_provider: str
+    ) -> str:
+        """基于历史记录异步重写问题"""
+        if not _needs_rewrite(question, chat_history):
+            return question
+        
+        key = self._rewrite_cache_key(question, chat_history, llm_provider)
+        cached = self._get_cached_rewrite(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            history_text = self._format_chat_history(chat_history)
+            rewrite_chain = self._get_chain("question_rewrite", llm_provider)
             
-            rewritten = rewrite_chain.invoke(question)
-            return rewritten.strip()
+            rewritten = (await rewrite_chain.ainvoke({"chat_history": history_text, "question": question})).strip()
+            self._cache_rewrite(key, rewritten)
+            return rewritten
         
         except Exception:
             # 如果重写失败，返回原问题
@@ -308,4 +551,23 @@ class LangChainRAGPipeline:
                 "total_time": time.time() - start_time,
                 "retrieved_docs": 0
             }
-        }
\ No newline at end of file
+        }
+    
+    def _error_response(
+        self,
+        question: str,
+        provider: Optional[str],
+        error: Exception,
+        start_time: float
+    ) -> Dict[str, Any]:
+        """查询出错时的响应"""
+        return {
+            "question": question,
+            "answer": f"查询过程中发生错误: {str(error)}",
+            "sources": [],
+            "meta": {
+                "provider": provider or self.current_provider,
+                "error": str(error),
+                "total_time": time.time() - start_time
+            }
+        }
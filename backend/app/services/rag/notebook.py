@@ -1,15 +1,51 @@
-from typing import List, Dict, Any, Optional
-from datetime import datetime
-import json
+from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import atexit
 import os
+import re
+import threading
+import time
+import orjson
+import ulid
 from pathlib import Path
 from ..vectorstores.factory import VectorStoreFactory
 from ..embeddings.factory import EmbeddingFactory
 from ..document_processor.loader import DocumentLoader
 from ..document_processor.chunker import TextChunker
+from ..retrievers.factory import invalidate_bm25_cache, invalidate_fallback_cache
+from ..retrievers.reranker import invalidate_rerank_cache
+from .semantic_cache import invalidate_semantic_cache
 from .langchain_pipeline import LangChainRAGPipeline
 from ..config import AppConfig
 
+def _load_metadata_file(path: str) -> Optional[Dict[str, Any]]:
+    """读取单个笔记本元数据文件，不存在或解析失败时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading notebook {path}: {e}")
+        return None
+
+def _write_metadata_file(path: Path, notebook: Dict[str, Any]):
+    """原子写入元数据文件：先写临时文件再替换，崩溃时不会留下半截文件"""
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_bytes(orjson.dumps(notebook, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    os.replace(tmp, path)
+
+# ULID：26 位 Crockford Base32，字典序即创建时间顺序
+_ULID_PATTERN = re.compile(r'^[0-9A-HJKMNP-TV-Z]{26}$')
+
+# 连续更新元数据时合并写盘的延迟（秒）
+METADATA_FLUSH_DELAY = 0.1
+# 首次更新后最长的写盘等待时间（秒），持续更新时也不会无限推迟
+METADATA_FLUSH_MAX_DELAY = 1.0
+# 内存中缓存的笔记本元数据条数
+METADATA_CACHE_SIZE = 512
+
 class NotebookManager:
     """笔记本管理器"""
     
@@ -24,15 +60,28 @@ class NotebookManager:
         self.document_loader = DocumentLoader()
         self.text_chunker = TextChunker(config)
         self.rag_pipeline = LangChainRAGPipeline(config)
+        
+        # 待写盘的元数据（笔记本 ID -> 最新元数据），由定时器合并写入
+        self._pending_metadata: Dict[str, Dict[str, Any]] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        # 本轮合并写盘的最晚时间（time.monotonic），无待写元数据时为 None
+        self._flush_deadline: Optional[float] = None
+        self._metadata_lock = threading.Lock()
+        # 定时器为守护线程，进程退出前写入尚未落盘的元数据
+        atexit.register(self.flush_metadata)
+        
+        # 元数据读缓存：笔记本 ID -> ((mtime_ns, inode), 元数据)，文件被替换后自动失效
+        self._meta_cache: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, Any]]]" = OrderedDict()
     
     def create_notebook(self, name: str) -> Dict[str, Any]:
         """创建新笔记本"""
         notebook_id = self._generate_id()
+        now = int(time.time())
         notebook = {
             "id": notebook_id,
             "name": name,
-            "created_at": int(datetime.now().timestamp()),
-            "updated_at": int(datetime.now().timestamp()),
+            "created_at": now,
+            "updated_at": now,
             "document_count": 0,
             "metadata": {}
         }
@@ -47,30 +96,56 @@ class NotebookManager:
     
     def list_notebooks(self) -> List[Dict[str, Any]]:
         """列出所有笔记本"""
-        notebooks = []
-        for notebook_file in self.storage_dir.glob("*/metadata.json"):
-            try:
-                with open(notebook_file, 'r', encoding='utf-8') as f:
-                    notebook = json.load(f)
-                    notebooks.append(notebook)
-            except Exception as e:
-                print(f"Error loading notebook {notebook_file}: {e}")
+        with os.scandir(self.storage_dir) as it:
+            entries = [(entry.name, entry.path) for entry in it if entry.is_dir()]
+        
+        # ID 全为 ULID 时按目录名倒序即为创建时间倒序，无需读取后再排序
+        ordered_by_id = all(_ULID_PATTERN.match(name) for name, _ in entries)
+        if ordered_by_id:
+            entries.sort(reverse=True)
+        metadata_files = [os.path.join(path, "metadata.json") for _, path in entries]
+        
+        # 并行读取各笔记本的元数据文件（map 保持输入顺序）
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            notebooks = [nb for nb in executor.map(_load_metadata_file, metadata_files) if nb is not None]
         
-        # 按创建时间倒序排列
-        notebooks.sort(key=lambda x: x.get('created_at', 0), reverse=True)
+        if not ordered_by_id:
+            # 兼容旧的 UUID 笔记本：按创建时间倒序排列
+            notebooks.sort(key=lambda x: x.get('created_at', 0), reverse=True)
         return notebooks
     
     def get_notebook(self, notebook_id: str) -> Optional[Dict[str, Any]]:
         """获取笔记本信息"""
+        with self._metadata_lock:
+            pending = self._pending_metadata.get(notebook_id)
+            if pending is not None:
+                return dict(pending)
+        
         metadata_file = self.storage_dir / notebook_id / "metadata.json"
-        if not metadata_file.exists():
+        try:
+            st = metadata_file.stat()
+        except OSError:
             return None
+        # 元数据总是以 os.replace 整体替换，mtime 或 inode 变化即说明文件已更新
+        version = (st.st_mtime_ns, st.st_ino)
+        
+        with self._metadata_lock:
+            cached = self._meta_cache.get(notebook_id)
+            if cached is not None and cached[0] == version:
+                self._meta_cache.move_to_end(notebook_id)
+                return dict(cached[1])
         
         try:
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            notebook = orjson.loads(metadata_file.read_bytes())
         except Exception:
             return None
+        
+        with self._metadata_lock:
+            self._meta_cache[notebook_id] = (version, notebook)
+            self._meta_cache.move_to_end(notebook_id)
+            if len(self._meta_cache) > METADATA_CACHE_SIZE:
+                self._meta_cache.popitem(last=False)
+        return dict(notebook)
     
     def delete_notebook(self, notebook_id: str) -> bool:
         """删除笔记本"""
@@ -78,9 +153,17 @@ class NotebookManager:
         if not notebook_dir.exists():
             return False
         
+        with self._metadata_lock:
+            self._pending_metadata.pop(notebook_id, None)
+            self._meta_cache.pop(notebook_id, None)
+        
         try:
             # 删除向量存储
             self._cleanup_vector_store(notebook_id)
+            invalidate_bm25_cache(f"notebook_{notebook_id}")
+            invalidate_fallback_cache(f"notebook_{notebook_id}")
+            invalidate_rerank_cache(f"notebook_{notebook_id}")
+            invalidate_semantic_cache(notebook_id)
             
             # 删除文件夹
             import shutil
@@ -97,8 +180,9 @@ class NotebookManager:
             return False
         
         try:
-            # 文本分块
-            chunks = []
+            # 文本分块：汇总所有文本的分块，一次性批量写入向量存储
+            all_chunks: List[str] = []
+            all_metas: List[Dict[str, Any]] = []
             for i, text in enumerate(texts):
                 text_chunks = self.text_chunker.chunk_text(text)
                 for j, chunk in enumerate(text_chunks):
@@ -108,19 +192,23 @@ class NotebookManager:
                         "notebook_id": notebook_id,
                         **(metadata or {})
                     }
-                    chunks.append((chunk, chunk_metadata))
+                    all_chunks.append(chunk)
+                    all_metas.append(chunk_metadata)
             
-            # 添加到向量存储
+            # 按批嵌入后写入向量存储
             vector_store = self._get_vector_store(notebook_id)
-            texts_to_add = [chunk[0] for chunk in chunks]
-            metadatas_to_add = [chunk[1] for chunk in chunks]
+            self.vector_store_factory.ingest(vector_store, all_chunks, all_metas)
             
-            vector_store.add_texts(texts_to_add, metadatas=metadatas_to_add)
+            # 知识库内容变化，旧的缓存回答、BM25 索引与检索结果可能失效
+            invalidate_semantic_cache(notebook_id)
+            invalidate_bm25_cache(f"notebook_{notebook_id}")
+            invalidate_fallback_cache(f"notebook_{notebook_id}")
+            invalidate_rerank_cache(f"notebook_{notebook_id}")
             
             # 更新笔记本元数据
             notebook["document_count"] += len(texts)
-            notebook["updated_at"] = int(datetime.now().timestamp())
-            self._save_notebook_metadata(notebook)
+            notebook["updated_at"] = int(time.time())
+            self._save_notebook_metadata(notebook, debounce=True)
             
             return True
         except Exception as e:
@@ -146,18 +234,67 @@ class NotebookManager:
             return {"error": str(e)}
     
     def _generate_id(self) -> str:
-        """生成唯一ID"""
-        import uuid
-        return str(uuid.uuid4())
+        """生成唯一ID（ULID，按创建时间有序）"""
+        return ulid.new().str
+    
+    def _save_notebook_metadata(self, notebook: Dict[str, Any], debounce: bool = False):
+        """保存笔记本元数据
+
+        debounce 为 True 时延迟 METADATA_FLUSH_DELAY 秒写盘，期间的多次更新只写最后一次；
+        自首次更新起最多等待 METADATA_FLUSH_MAX_DELAY 秒。
+        """
+        if not debounce:
+            with self._metadata_lock:
+                self._pending_metadata.pop(notebook["id"], None)
+            self._write_notebook_metadata(notebook)
+            return
+        
+        with self._metadata_lock:
+            self._pending_metadata[notebook["id"]] = dict(notebook)
+            now = time.monotonic()
+            if self._flush_deadline is None:
+                self._flush_deadline = now + METADATA_FLUSH_MAX_DELAY
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            delay = max(0.0, min(METADATA_FLUSH_DELAY, self._flush_deadline - now))
+            self._flush_timer = threading.Timer(delay, self.flush_metadata)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def flush_metadata(self):
+        """立即写入所有待写盘的元数据
+
+        写入成功后才移除待写条目，写盘期间 get_notebook 仍能读到最新元数据。
+        """
+        with self._metadata_lock:
+            pending = dict(self._pending_metadata)
+            self._flush_deadline = None
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        
+        written = []
+        for notebook_id, notebook in pending.items():
+            # 笔记本可能已在等待期间被删除
+            if not (self.storage_dir / notebook_id).is_dir():
+                written.append((notebook_id, notebook))
+                continue
+            try:
+                self._write_notebook_metadata(notebook)
+                written.append((notebook_id, notebook))
+            except Exception as e:
+                print(f"Error saving notebook {notebook_id}: {e}")
+        
+        with self._metadata_lock:
+            for notebook_id, notebook in written:
+                # 写盘期间又有新的更新时保留待写条目，由下一次写盘处理
+                if self._pending_metadata.get(notebook_id) is notebook:
+                    del self._pending_metadata[notebook_id]
     
-    def _save_notebook_metadata(self, notebook: Dict[str, Any]):
-        """保存笔记本元数据"""
+    def _write_notebook_metadata(self, notebook: Dict[str, Any]):
         notebook_dir = self.storage_dir / notebook["id"]
         notebook_dir.mkdir(parents=True, exist_ok=True)
-        
-        metadata_file = notebook_dir / "metadata.json"
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(notebook, f, ensure_ascii=False, indent=2)
+        _write_metadata_file(notebook_dir / "metadata.json", notebook)
     
     def _initialize_vector_store(self, notebook_id: str):
         """初始化向量存储"""
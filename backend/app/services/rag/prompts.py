@@ -1,8 +1,24 @@
-from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    PromptTemplate,
+    SystemMessagePromptTemplate
+)
 from typing import Dict, Any
 
+def _chat_template(system_message: str, human_message: str) -> ChatPromptTemplate:
+    """由预先构建的系统 / 用户消息模板组成对话模板（跳过按角色字符串解析消息）"""
+    return ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template(system_message),
+        HumanMessagePromptTemplate.from_template(human_message)
+    ])
+
 class RAGPrompts:
-    """RAG 系统提示模板集合"""
+    """RAG 系统提示模板集合
+
+    系统消息只放固定的指令，检索上下文、对话历史等变量都放在用户消息中，
+    使各次请求共享相同的前缀，便于模型服务端做提示缓存。
+    """
     
     def __init__(self):
         self.templates = self._initialize_templates()
@@ -37,6 +53,25 @@ class RAGPrompts:
         """获取信息提取提示模板"""
         return self.templates["extraction"]
     
+    def to_anthropic_messages(self, name: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+        """按 Anthropic Messages API 的格式渲染模板
+
+        返回 {"system": [...], "messages": [...]}；固定的系统指令标记 cache_control，作为可缓存前缀。
+        """
+        system_blocks = []
+        messages = []
+        for message in self.templates[name].format_messages(**variables):
+            if message.type == "system":
+                system_blocks.append({
+                    "type": "text",
+                    "text": message.content,
+                    "cache_control": {"type": "ephemeral"}
+                })
+            else:
+                role = "assistant" if message.type == "ai" else "user"
+                messages.append({"role": role, "content": message.content})
+        return {"system": system_blocks, "messages": messages}
+    
     def _create_qa_template(self) -> ChatPromptTemplate:
         """创建基础问答模板"""
         system_message = """你是一个专业的知识库助手，能够基于提供的上下文信息准确回答用户问题。
@@ -46,17 +81,14 @@ class RAGPrompts:
 2. 如果上下文中没有相关信息，请明确说明
 3. 回答要准确、简洁、有条理
 4. 可以适当引用上下文中的具体内容
-5. 使用中文回答
-
-上下文信息：
-{context}"""
+5. 使用中文回答"""
         
-        human_message = "问题：{question}"
+        human_message = """上下文信息：
+{context}
+
+问题：{question}"""
         
-        return ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("human", human_message)
-        ])
+        return _chat_template(system_message, human_message)
     
     def _create_conversational_qa_template(self) -> ChatPromptTemplate:
         """创建对话式问答模板"""
@@ -68,20 +100,17 @@ class RAGPrompts:
 3. 如果上下文中没有相关信息，请明确说明
 4. 回答要准确、简洁、有条理
 5. 可以适当引用上下文中的具体内容
-6. 使用中文回答
-
-对话历史：
+6. 使用中文回答"""
+        
+        human_message = """对话历史：
 {chat_history}
 
 上下文信息：
-{context}"""
-        
-        human_message = "问题：{question}"
+{context}
+
+问题：{question}"""
         
-        return ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("human", human_message)
-        ])
+        return _chat_template(system_message, human_message)
     
     def _create_question_rewrite_template(self) -> ChatPromptTemplate:
         """创建问题重写模板"""
@@ -92,17 +121,11 @@ class RAGPrompts:
 2. 补充必要的上下文信息
 3. 确保重写后的问题可以独立理解
 4. 使用中文
-5. 如果当前问题已经很完整，可以保持不变
-
-对话历史：
-{chat_history}"""
+5. 如果当前问题已经很完整，可以保持不变"""
         
-        human_message = "当前问题：{question}\n\n请重写这个问题："
+        human_message = "对话历史：\n{chat_history}\n\n当前问题：{question}\n\n请重写这个问题："
         
-        return ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("human", human_message)
-        ])
+        return _chat_template(system_message, human_message)
     
     def _create_summarization_template(self) -> ChatPromptTemplate:
         """创建摘要模板"""
@@ -117,10 +140,7 @@ class RAGPrompts:
         
         human_message = "请为以下文档生成摘要：\n\n{content}"
         
-        return ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("human", human_message)
-        ])
+        return _chat_template(system_message, human_message)
     
     def _create_extraction_template(self) -> ChatPromptTemplate:
         """创建信息提取模板"""
@@ -140,7 +160,13 @@ class RAGPrompts:
 
 请提取相关信息："""
         
-        return ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("human", human_message)
-        ])
\ No newline at end of file
+        return _chat_template(system_message, human_message)
+
+# 模板只在导入时构建一次，全进程共享
+RAG_PROMPTS = RAGPrompts()
+
+get_qa_prompt = RAG_PROMPTS.get_qa_prompt
+get_conversational_qa_prompt = RAG_PROMPTS.get_conversational_qa_prompt
+get_question_rewrite_prompt = RAG_PROMPTS.get_question_rewrite_prompt
+get_summarization_prompt = RAG_PROMPTS.get_summarization_prompt
+get_extraction_prompt = RAG_PROMPTS.get_extraction_prompt
@@ -0,0 +1,87 @@
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import copy
+import threading
+import time
+import numpy as np
+
+class SemanticCache:
+    """语义查询缓存：问题向量与历史问题余弦相似度超过阈值时复用已有回答"""
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # 命名空间 -> (归一化问题向量矩阵, [(过期时间, 响应)])
+        self._spaces: Dict[Hashable, Tuple[np.ndarray, List[Tuple[float, Dict[str, Any]]]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, namespace: Hashable, vector: List[float]) -> Optional[Dict[str, Any]]:
+        """查找语义相近且未过期的缓存响应"""
+        with self._lock:
+            space = self._spaces.get(namespace)
+            if space is None:
+                return None
+            vectors, payloads = space
+            if vectors.shape[1] != len(vector):
+                return None
+
+            sims = vectors @ self._normalize(vector)
+            best = int(np.argmax(sims))
+            expires_at, response = payloads[best]
+            if sims[best] < self.threshold or expires_at < time.time():
+                return None
+            return copy.deepcopy(response)
+
+    def add(self, namespace: Hashable, vector: List[float], response: Dict[str, Any]):
+        """写入缓存，同时清理过期条目并限制条目数"""
+        vec = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            vectors, payloads = self._spaces.get(
+                namespace, (np.empty((0, len(vec)), dtype=np.float32), [])
+            )
+            if vectors.shape[1] != len(vec):
+                vectors, payloads = np.empty((0, len(vec)), dtype=np.float32), []
+
+            keep = [i for i, (expires_at, _) in enumerate(payloads) if expires_at >= now]
+            keep = keep[-(self.max_entries - 1):] if self.max_entries > 1 else []
+            vectors = np.vstack([vectors[keep], vec[None, :]])
+            payloads = [payloads[i] for i in keep] + [(now + self.ttl, copy.deepcopy(response))]
+            self._spaces[namespace] = (vectors, payloads)
+
+    def invalidate(self, notebook_id: Optional[str] = None):
+        """清除某个笔记本（命名空间首元素）或全部缓存"""
+        with self._lock:
+            if notebook_id is None:
+                self._spaces.clear()
+                return
+            for namespace in list(self._spaces):
+                if isinstance(namespace, tuple) and namespace and namespace[0] == notebook_id:
+                    del self._spaces[namespace]
+
+# 进程内共享的语义缓存：(阈值, TTL, 条目数) -> 缓存
+# 同一进程中的多个流水线共用同一份缓存，写入或删除文档时统一失效
+_SHARED_CACHES: Dict[Tuple[float, float, int], SemanticCache] = {}
+_SHARED_CACHES_LOCK = threading.Lock()
+
+def get_semantic_cache(threshold: float, ttl: float, max_entries: int) -> SemanticCache:
+    """获取（必要时创建）共享的语义缓存"""
+    key = (threshold, ttl, max_entries)
+    with _SHARED_CACHES_LOCK:
+        cache = _SHARED_CACHES.get(key)
+        if cache is None:
+            cache = _SHARED_CACHES[key] = SemanticCache(threshold, ttl, max_entries)
+        return cache
+
+def invalidate_semantic_cache(notebook_id: Optional[str] = None):
+    """清除所有共享缓存中某个笔记本（或全部）的缓存回答，写入或删除文档后调用"""
+    with _SHARED_CACHES_LOCK:
+        caches = list(_SHARED_CACHES.values())
+    for cache in caches:
+        cache.invalidate(notebook_id)
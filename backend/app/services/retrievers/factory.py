@@ -1,4 +1,6 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Hashable, List, Tuple
+from collections import OrderedDict
+from functools import cached_property, wraps
 from langchain_core.vectorstores import VectorStore
 from langchain_core.retrievers import BaseRetriever
 from langchain.retrievers import (
@@ -9,13 +11,140 @@ from langchain.retrievers import (
 )
 from langchain.retrievers.document_compressors import LLMChainExtractor
 from ..config import AppConfig
-from .reranker import MMRReranker, BasicReranker
+from ..llms.factory import LLMFactory
+from .reranker import MMRReranker, BasicReranker, CrossEncoderReranker, _collection_name
+from .ensemble import AsyncEnsembleRetriever, ReciprocalRankFusionRetriever
+from sklearn.feature_extraction.text import TfidfVectorizer
+import logging
+import threading
+import pybreaker
+
+logger = logging.getLogger(__name__)
+
+# 连续失败 5 次后熔断 30 秒，期间直接使用缓存的向量检索器，不再尝试失败的路径
+BREAKER_FAIL_MAX = 5
+BREAKER_RESET_TIMEOUT = 30
+
+class _CorpusIndex:
+    """集合级别的词法索引：BM25 检索器，以及按需在全量语料上拟合的 TF-IDF 模型"""
+    
+    def __init__(self, bm25: BM25Retriever):
+        self.bm25 = bm25
+    
+    @cached_property
+    def vectorizer(self) -> TfidfVectorizer:
+        vectorizer = TfidfVectorizer(stop_words='english', max_features=1000)
+        vectorizer.fit([doc.page_content for doc in self.bm25.docs])
+        return vectorizer
+
+# 词法索引缓存：集合名 -> (集合指纹, 索引)，按集合 LRU 淘汰
+BM25_CACHE_SIZE = 32
+_BM25_CACHE: "OrderedDict[str, Tuple[Hashable, _CorpusIndex]]" = OrderedDict()
+_BM25_CACHE_LOCK = threading.Lock()
+
+def _collection_fingerprint(vector_store: VectorStore) -> Optional[Tuple[str, Hashable]]:
+    """返回 (集合名, 指纹)；无法识别的向量存储返回 None（不缓存）"""
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        # Chroma
+        return collection.name, collection.count()
+    col = getattr(vector_store, "col", None)
+    if col is not None:
+        # Milvus
+        return vector_store.collection_name, col.num_entities
+    return None
+
+# Milvus 分页读取全部文档时每页的条数
+MILVUS_DUMP_BATCH_SIZE = 1000
+
+def _dump_corpus(vector_store: VectorStore) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """直接读取集合中的全部文本与元数据（不走向量检索，也没有条数上限）"""
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        # Chroma：一次取出文档列与元数据列
+        result = collection.get(include=["documents", "metadatas"])
+        return result["documents"], [meta or {} for meta in result["metadatas"]]
+    
+    col = getattr(vector_store, "col", None)
+    if col is not None:
+        # Milvus：按主键分页迭代，元数据字段与 LangChain 的检索结果保持一致
+        text_field = vector_store._text_field
+        output_fields = [f.name for f in col.schema.fields if f.name != vector_store._vector_field]
+        iterator = col.query_iterator(
+            batch_size=MILVUS_DUMP_BATCH_SIZE,
+            expr=f"{vector_store._primary_field} >= 0",
+            output_fields=output_fields
+        )
+        texts, metadatas = [], []
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                for row in rows:
+                    row = dict(row)
+                    texts.append(row.pop(text_field))
+                    metadatas.append(row)
+        finally:
+            iterator.close()
+        return texts, metadatas
+    
+    # 其他向量存储：退回到空查询的相似度检索
+    texts, metadatas = [], []
+    for doc in vector_store.similarity_search("", k=10000):
+        texts.append(doc.page_content)
+        metadatas.append(doc.metadata)
+    return texts, metadatas
+
+def invalidate_bm25_cache(collection_name: Optional[str] = None):
+    """清除某个集合（或全部）的 BM25 索引缓存，写入文档后调用"""
+    with _BM25_CACHE_LOCK:
+        if collection_name is None:
+            _BM25_CACHE.clear()
+        else:
+            _BM25_CACHE.pop(collection_name, None)
+
+# 回退用的向量检索器缓存：(集合名, 检索参数) -> 检索器，按 LRU 淘汰
+FALLBACK_CACHE_SIZE = 64
+_FALLBACK_CACHE: "OrderedDict[Tuple[str, str], BaseRetriever]" = OrderedDict()
+_FALLBACK_CACHE_LOCK = threading.Lock()
+
+def invalidate_fallback_cache(collection_name: Optional[str] = None):
+    """清除某个集合（或全部）缓存的回退检索器，写入文档或删除集合后调用"""
+    with _FALLBACK_CACHE_LOCK:
+        if collection_name is None:
+            _FALLBACK_CACHE.clear()
+            return
+        for key in [key for key in _FALLBACK_CACHE if key[0] == collection_name]:
+            del _FALLBACK_CACHE[key]
+
+def _with_vector_fallback(kind: str):
+    """检索器构建失败时记录日志并回退到（缓存的）向量检索器
+
+    构建过程受 kind 对应的熔断器保护：连续失败后直接回退，不再尝试失败的路径。
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(self, vector_store: VectorStore, search_kwargs: Dict[str, Any]) -> BaseRetriever:
+            try:
+                with self._breakers[kind].calling():
+                    return fn(self, vector_store, search_kwargs)
+            except Exception as e:
+                logger.warning("%s failed: %s", fn.__name__, e)
+                return self._fallback_retriever(vector_store, search_kwargs)
+        return wrapper
+    return decorator
 
 class RetrieverFactory:
     """检索器工厂类"""
     
     def __init__(self, config: AppConfig):
         self.config = config
+        # 各检索策略的熔断器
+        self._breakers: Dict[str, pybreaker.CircuitBreaker] = {
+            kind: pybreaker.CircuitBreaker(fail_max=BREAKER_FAIL_MAX, reset_timeout=BREAKER_RESET_TIMEOUT)
+            for kind in ("bm25", "hybrid", "multi_query", "contextual_compression")
+        }
     
     def create_retriever(
         self, 
@@ -46,139 +175,195 @@ class RetrieverFactory:
         search_kwargs: Dict[str, Any]
     ) -> BaseRetriever:
         """创建向量检索器"""
+        if self.config.reranker_type == "cross_encoder":
+            # 两阶段：先召回较多候选，再由交叉编码器精排到 k 条
+            k = search_kwargs.get("k", self.config.top_k_retrieval)
+            retriever = vector_store.as_retriever(search_kwargs={
+                **search_kwargs,
+                "k": max(k, self.config.rerank_candidates)
+            })
+            reranker = CrossEncoderReranker(
+                model_name=self.config.cross_encoder_model,
+                top_k=k,
+                onnx=self.config.cross_encoder_onnx
+            )
+            return reranker.rerank_retriever(retriever)
+        
         retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
         
         # 应用重排序
         if self.config.reranker_type == "mmr":
             reranker = MMRReranker(lambda_mult=self.config.mmr_lambda)
-            return reranker.rerank_retriever(retriever)
+            vectorizer = None
+            if vector_store.embeddings is None:
+                # 无法在嵌入空间计算 MMR 时，使用在全量语料上拟合好的 TF-IDF 模型
+                try:
+                    index = self._get_corpus_index(vector_store)
+                    vectorizer = index.vectorizer if index is not None else None
+                except Exception as e:
+                    logger.warning("Failed to build TF-IDF index: %s", e)
+            return reranker.rerank_retriever(retriever, vectorizer=vectorizer)
         elif self.config.reranker_type == "basic":
             reranker = BasicReranker()
             return reranker.rerank_retriever(retriever)
         
         return retriever
     
+    @_with_vector_fallback("bm25")
     def _create_bm25_retriever(
         self, 
         vector_store: VectorStore, 
         search_kwargs: Dict[str, Any]
     ) -> BaseRetriever:
-        """创建 BM25 检索器"""
+        """创建 BM25 检索器
+
+        索引按集合缓存，集合文档数变化（或调用 invalidate_bm25_cache）后重建。
+        """
+        index = self._get_corpus_index(vector_store)
+        if index is None:
+            # 如果没有文档，回退到向量检索
+            return self._create_vector_retriever(vector_store, search_kwargs)
+        
+        # 浅拷贝后设置 k，不修改共享实例（索引本身不复制）
+        k = search_kwargs.get("k", self.config.top_k_retrieval)
+        return index.bm25.copy(update={"k": k})
+    
+    def _get_corpus_index(self, vector_store: VectorStore) -> Optional[_CorpusIndex]:
+        """获取（缓存的）集合词法索引；集合为空时返回 None"""
+        fingerprint = _collection_fingerprint(vector_store)
+        if fingerprint is not None:
+            collection_name, version = fingerprint
+            with _BM25_CACHE_LOCK:
+                cached = _BM25_CACHE.get(collection_name)
+                if cached is not None and cached[0] == version:
+                    _BM25_CACHE.move_to_end(collection_name)
+                    return cached[1]
+        
         # 获取所有文档用于 BM25 索引
-        try:
-            # 尝试获取所有文档
-            all_docs = vector_store.similarity_search("", k=10000)  # 获取大量文档
-            if not all_docs:
-                # 如果没有文档，回退到向量检索
-                return self._create_vector_retriever(vector_store, search_kwargs)
-            
-            # 提取文档内容
-            texts = [doc.page_content for doc in all_docs]
-            
-            # 创建 BM25 检索器
-            bm25_retriever = BM25Retriever.from_texts(
-                texts, 
-                metadatas=[doc.metadata for doc in all_docs]
-            )
-            bm25_retriever.k = search_kwargs.get("k", self.config.top_k_retrieval)
-            
-            return bm25_retriever
+        texts, metadatas = _dump_corpus(vector_store)
+        if not texts:
+            return None
         
-        except Exception as e:
-            print(f"Failed to create BM25 retriever: {e}")
-            # 回退到向量检索
-            return self._create_vector_retriever(vector_store, search_kwargs)
+        index = _CorpusIndex(BM25Retriever.from_texts(texts, metadatas=metadatas))
+        
+        if fingerprint is not None:
+            with _BM25_CACHE_LOCK:
+                _BM25_CACHE[collection_name] = (version, index)
+                _BM25_CACHE.move_to_end(collection_name)
+                if len(_BM25_CACHE) > BM25_CACHE_SIZE:
+                    _BM25_CACHE.popitem(last=False)
+        
+        return index
     
+    @_with_vector_fallback("hybrid")
     def _create_hybrid_retriever(
         self, 
         vector_store: VectorStore, 
         search_kwargs: Dict[str, Any]
     ) -> BaseRetriever:
         """创建混合检索器（向量 + BM25）"""
-        try:
-            # 创建向量检索器
-            vector_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
-            
-            # 创建 BM25 检索器
-            bm25_retriever = self._create_bm25_retriever(vector_store, search_kwargs)
-            
-            # 如果 BM25 创建失败，返回向量检索器
-            if isinstance(bm25_retriever, type(vector_retriever)):
-                return vector_retriever
-            
-            # 创建集成检索器
-            ensemble_retriever = EnsembleRetriever(
+        # 创建向量检索器
+        vector_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
+        
+        # 创建 BM25 检索器
+        bm25_retriever = self._create_bm25_retriever(vector_store, search_kwargs)
+        
+        # 如果 BM25 创建失败，返回向量检索器
+        if isinstance(bm25_retriever, type(vector_retriever)):
+            return vector_retriever
+        
+        # 创建集成检索器（各路检索并行执行）
+        if self.config.fusion_strategy == "weighted":
+            ensemble_retriever = AsyncEnsembleRetriever(
                 retrievers=[vector_retriever, bm25_retriever],
                 weights=[self.config.hybrid_alpha, 1 - self.config.hybrid_alpha]
             )
-            
-            return ensemble_retriever
+        else:
+            ensemble_retriever = ReciprocalRankFusionRetriever(
+                retrievers=[vector_retriever, bm25_retriever],
+                k=self.config.rrf_k
+            )
         
-        except Exception as e:
-            print(f"Failed to create hybrid retriever: {e}")
-            # 回退到向量检索
-            return self._create_vector_retriever(vector_store, search_kwargs)
+        return ensemble_retriever
     
+    @_with_vector_fallback("multi_query")
     def _create_multi_query_retriever(
         self, 
         vector_store: VectorStore, 
         search_kwargs: Dict[str, Any]
     ) -> BaseRetriever:
         """创建多查询检索器"""
-        try:
-            from ..llms.factory import LLMFactory
-            
-            # 获取 LLM
-            llm_factory = LLMFactory(self.config)
-            llm = llm_factory.get_llm()
-            
-            # 创建基础检索器
-            base_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
-            
-            # 创建多查询检索器
-            multi_query_retriever = MultiQueryRetriever.from_llm(
-                retriever=base_retriever,
-                llm=llm
-            )
-            
-            return multi_query_retriever
+        # 获取（缓存的）LLM
+        llm = self._llm
         
-        except Exception as e:
-            print(f"Failed to create multi-query retriever: {e}")
-            # 回退到向量检索
-            return self._create_vector_retriever(vector_store, search_kwargs)
+        # 创建基础检索器
+        base_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
+        
+        # 创建多查询检索器
+        multi_query_retriever = MultiQueryRetriever.from_llm(
+            retriever=base_retriever,
+            llm=llm
+        )
+        
+        return multi_query_retriever
     
+    @_with_vector_fallback("contextual_compression")
     def _create_contextual_compression_retriever(
         self, 
         vector_store: VectorStore, 
         search_kwargs: Dict[str, Any]
     ) -> BaseRetriever:
         """创建上下文压缩检索器"""
-        try:
-            from ..llms.factory import LLMFactory
-            
-            # 获取 LLM
-            llm_factory = LLMFactory(self.config)
-            llm = llm_factory.get_llm()
-            
-            # 创建基础检索器
-            base_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
-            
-            # 创建压缩器
-            compressor = LLMChainExtractor.from_llm(llm)
-            
-            # 创建上下文压缩检索器
-            compression_retriever = ContextualCompressionRetriever(
-                base_compressor=compressor,
-                base_retriever=base_retriever
-            )
-            
-            return compression_retriever
+        # 获取（缓存的）LLM
+        llm = self._llm
         
-        except Exception as e:
-            print(f"Failed to create contextual compression retriever: {e}")
-            # 回退到向量检索
+        # 创建基础检索器
+        base_retriever = vector_store.as_retriever(search_kwargs=search_kwargs)
+        
+        # 创建压缩器
+        compressor = LLMChainExtractor.from_llm(llm)
+        
+        # 创建上下文压缩检索器
+        compression_retriever = ContextualCompressionRetriever(
+            base_compressor=compressor,
+            base_retriever=base_retriever
+        )
+        
+        return compression_retriever
+    
+    @cached_property
+    def _llm(self):
+        """多查询 / 上下文压缩检索器使用的 LLM，每个工厂只创建一次"""
+        return LLMFactory(self.config).get_llm()
+    
+    def reload_llm(self):
+        """配置变化后丢弃缓存的 LLM，下次使用时重新创建"""
+        self.__dict__.pop("_llm", None)
+    
+    def _fallback_retriever(
+        self,
+        vector_store: VectorStore,
+        search_kwargs: Dict[str, Any]
+    ) -> BaseRetriever:
+        """回退用的向量检索器，按集合与检索参数缓存，避免每次失败后重复构建"""
+        collection_name = _collection_name(vector_store)
+        if collection_name is None:
             return self._create_vector_retriever(vector_store, search_kwargs)
+        
+        # 检索参数中可能含有不可哈希的过滤条件，用其 repr 作键
+        key = (collection_name, repr(sorted(search_kwargs.items())))
+        with _FALLBACK_CACHE_LOCK:
+            retriever = _FALLBACK_CACHE.get(key)
+            if retriever is not None:
+                _FALLBACK_CACHE.move_to_end(key)
+                return retriever
+        
+        retriever = self._create_vector_retriever(vector_store, search_kwargs)
+        with _FALLBACK_CACHE_LOCK:
+            _FALLBACK_CACHE[key] = retriever
+            if len(_FALLBACK_CACHE) > FALLBACK_CACHE_SIZE:
+                _FALLBACK_CACHE.popitem(last=False)
+        return retriever
     
     def get_available_types(self) -> list[str]:
         """获取可用的检索器类型"""
@@ -196,5 +381,5 @@ class RetrieverFactory:
             results = retriever.get_relevant_documents(query)
             return True
         except Exception as e:
-            print(f"Retriever test failed: {e}")
+            logger.warning("Retriever test failed: %s", e)
             return False
\ No newline at end of file
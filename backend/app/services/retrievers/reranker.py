@@ -1,9 +1,18 @@
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Tuple, Hashable
 from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
 from langchain_core.documents import Document
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun
+)
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import copy
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 class BaseReranker:
@@ -21,9 +30,14 @@ class BaseReranker:
         """重排序文档"""
         raise NotImplementedError
     
-    def rerank_retriever(self, retriever: BaseRetriever) -> BaseRetriever:
+    def rerank_retriever(self, retriever: BaseRetriever, vectorizer: Any = None) -> BaseRetriever:
         """包装检索器以添加重排序功能"""
-        return RerankedRetriever(retriever, self)
+        return RerankedRetriever(retriever, self, vectorizer=vectorizer)
+    
+    @property
+    def cache_key(self) -> Hashable:
+        """决定重排序结果的参数，用作检索结果缓存键的一部分"""
+        return (type(self).__name__,)
 
 class BasicReranker(BaseReranker):
     """基础重排序器（按相似度分数排序）"""
@@ -53,7 +67,13 @@ class BasicReranker(BaseReranker):
         return reranked
 
 class MMRReranker(BaseReranker):
-    """最大边际相关性（MMR）重排序器"""
+    """最大边际相关性（MMR）重排序器
+
+    提供查询与文档的嵌入向量时在嵌入空间计算相似度；否则退回到 TF-IDF 相似度。
+    """
+    
+    # RerankedRetriever 据此决定是否随文档一起获取嵌入向量
+    uses_embeddings = True
     
     def __init__(self, lambda_mult: float = 0.5, k1: int = 20):
         super().__init__()
@@ -61,13 +81,23 @@ class MMRReranker(BaseReranker):
         self.k1 = k1  # 初始检索数量
         self.vectorizer = TfidfVectorizer(stop_words='english', max_features=1000)
     
+    @property
+    def cache_key(self) -> Hashable:
+        return (type(self).__name__, self.lambda_mult)
+    
     def rerank_documents(
         self, 
         query: str, 
         documents: List[Document], 
-        top_k: Optional[int] = None
+        top_k: Optional[int] = None,
+        query_embedding: Optional[List[float]] = None,
+        doc_embeddings: Optional[List[List[float]]] = None,
+        vectorizer: Optional[TfidfVectorizer] = None
     ) -> List[Document]:
-        """使用 MMR 算法重排序"""
+        """使用 MMR 算法重排序
+
+        vectorizer 为已在全量语料上拟合的 TF-IDF 模型时只做 transform，不再逐次拟合。
+        """
         if not documents:
             return documents
         
@@ -75,54 +105,30 @@ class MMRReranker(BaseReranker):
             return documents
         
         try:
-            # 准备文本数据
-            doc_texts = [doc.page_content for doc in documents]
-            all_texts = [query] + doc_texts
-            
-            # 计算 TF-IDF 向量
-            tfidf_matrix = self.vectorizer.fit_transform(all_texts)
-            query_vec = tfidf_matrix[0:1]  # 查询向量
-            doc_vecs = tfidf_matrix[1:]     # 文档向量
-            
-            # 计算查询与文档的相似度
-            query_similarities = cosine_similarity(query_vec, doc_vecs).flatten()
+            if query_embedding is not None and doc_embeddings is not None:
+                query_similarities, sim_matrix = self._embedding_similarities(query_embedding, doc_embeddings)
+            else:
+                query_similarities, sim_matrix = self._tfidf_similarities(query, documents, vectorizer)
             
-            # MMR 算法
-            selected_indices = []
-            remaining_indices = list(range(len(documents)))
-            
-            # 选择第一个文档（相似度最高的）
-            first_idx = np.argmax(query_similarities)
-            selected_indices.append(first_idx)
-            remaining_indices.remove(first_idx)
-            
-            # 迭代选择剩余文档
+            available = np.ones(len(documents), dtype=bool)
             target_count = min(top_k or len(documents), len(documents))
             
-            while len(selected_indices) < target_count and remaining_indices:
-                mmr_scores = []
-                
-                for idx in remaining_indices:
-                    # 计算与查询的相似度
-                    query_sim = query_similarities[idx]
-                    
-                    # 计算与已选择文档的最大相似度
-                    max_sim_to_selected = 0.0
-                    if selected_indices:
-                        selected_vecs = doc_vecs[selected_indices]
-                        current_vec = doc_vecs[idx:idx+1]
-                        similarities_to_selected = cosine_similarity(current_vec, selected_vecs).flatten()
-                        max_sim_to_selected = np.max(similarities_to_selected)
-                    
-                    # 计算 MMR 分数
-                    mmr_score = (self.lambda_mult * query_sim - 
-                               (1 - self.lambda_mult) * max_sim_to_selected)
-                    mmr_scores.append((idx, mmr_score))
+            # MMR 算法：首个文档只看相关性，即与查询相似度最高者
+            first_idx = int(np.argmax(query_similarities))
+            selected_indices = [first_idx]
+            available[first_idx] = False
+            # max_sim 记录每个文档与已选文档的最大相似度，每选一个只需 O(N) 更新；
+            # 嵌入空间的内积可能为负，因此从首个已选文档的相似度开始，而不是从 0 开始
+            max_sim = np.array(sim_matrix[first_idx], dtype=np.float64)
+            
+            while len(selected_indices) < target_count:
+                mmr_scores = self.lambda_mult * query_similarities - (1 - self.lambda_mult) * max_sim
+                mmr_scores[~available] = -np.inf
+                best_idx = int(np.argmax(mmr_scores))
                 
-                # 选择 MMR 分数最高的文档
-                best_idx, best_score = max(mmr_scores, key=lambda x: x[1])
                 selected_indices.append(best_idx)
-                remaining_indices.remove(best_idx)
+                available[best_idx] = False
+                np.maximum(max_sim, sim_matrix[best_idx], out=max_sim)
             
             # 返回重排序的文档
             reranked_docs = [documents[i] for i in selected_indices]
@@ -130,7 +136,7 @@ class MMRReranker(BaseReranker):
             # 更新文档的分数元数据
             for i, doc in enumerate(reranked_docs):
                 doc.metadata['mmr_rank'] = i + 1
-                doc.metadata['original_score'] = query_similarities[selected_indices[i]]
+                doc.metadata['original_score'] = float(query_similarities[selected_indices[i]])
             
             return reranked_docs
         
@@ -138,14 +144,239 @@ class MMRReranker(BaseReranker):
             print(f"MMR reranking failed: {e}")
             # 回退到基础排序
             return BasicReranker().rerank_documents(query, documents, top_k)
+    
+    def _embedding_similarities(
+        self,
+        query_embedding: List[float],
+        doc_embeddings: List[List[float]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """嵌入空间的余弦相似度
+
+        入库向量在写入时已 L2 归一化，查询向量由嵌入模型归一化输出，余弦相似度即内积。
+        """
+        doc_matrix = np.asarray(doc_embeddings, dtype=np.float32)
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        return doc_matrix @ query_vec, doc_matrix @ doc_matrix.T
+    
+    def _tfidf_similarities(
+        self,
+        query: str,
+        documents: List[Document],
+        vectorizer: Optional[TfidfVectorizer] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """TF-IDF 余弦相似度（无法获得嵌入向量时使用）"""
+        all_texts = [query] + [doc.page_content for doc in documents]
+        
+        # 计算 TF-IDF 向量
+        if vectorizer is not None:
+            tfidf_matrix = vectorizer.transform(all_texts)
+        else:
+            tfidf_matrix = self.vectorizer.fit_transform(all_texts)
+        query_vec = tfidf_matrix[0:1]  # 查询向量
+        doc_vecs = tfidf_matrix[1:]     # 文档向量
+        
+        # TfidfVectorizer 输出的行向量已 L2 归一化，余弦相似度即稀疏矩阵点积
+        query_similarities = (doc_vecs @ query_vec.T).toarray().ravel()
+        return query_similarities, (doc_vecs @ doc_vecs.T).toarray()
+
+# 交叉编码器单次前向的（查询, 文档）对数
+CROSS_ENCODER_BATCH_SIZE = 32
+
+@lru_cache(maxsize=None)
+def _load_cross_encoder(model_name: str, onnx: bool):
+    """加载交叉编码器（每个进程每个模型只加载一次）
+
+    onnx 为 True 时导出 ONNX 并做 int8 动态量化，返回 (tokenizer, 模型)；否则返回 CrossEncoder。
+    """
+    if not onnx:
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ImportError("Please install sentence-transformers: pip install sentence-transformers")
+        from ..embeddings.provider import configure_torch_threads
+        configure_torch_threads()
+        return CrossEncoder(model_name)
+    
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+    except ImportError:
+        raise ImportError("Please install optimum with onnxruntime: pip install optimum[onnxruntime]")
+    
+    onnx_dir = Path("app/storage/onnx") / model_name.replace("/", "__")
+    quantized_file = onnx_dir / "model_quantized.onnx"
+    if not quantized_file.exists():
+        exported = ORTModelForSequenceClassification.from_pretrained(
+            model_name, export=True, provider="CPUExecutionProvider"
+        )
+        quantizer = ORTQuantizer.from_pretrained(exported)
+        quantizer.quantize(
+            save_dir=onnx_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        )
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = ORTModelForSequenceClassification.from_pretrained(
+        onnx_dir, file_name=quantized_file.name, provider="CPUExecutionProvider"
+    )
+    return tokenizer, model
+
+class CrossEncoderReranker(BaseReranker):
+    """交叉编码器重排序器：（查询, 文档）对批量前向打分，按分数取前 top_k"""
+    
+    def __init__(
+        self,
+        model_name: str = "BAAI/bge-reranker-base",
+        top_k: Optional[int] = None,
+        onnx: bool = False
+    ):
+        super().__init__()
+        self.model_name = model_name
+        self.top_k = top_k
+        self.onnx = onnx
+        self.model = _load_cross_encoder(model_name, onnx)
+    
+    @property
+    def cache_key(self) -> Hashable:
+        return (type(self).__name__, self.model_name, self.top_k, self.onnx)
+    
+    def _predict(self, query: str, texts: List[str]) -> np.ndarray:
+        if not self.onnx:
+            return np.asarray(self.model.predict(
+                [[query, text] for text in texts],
+                batch_size=CROSS_ENCODER_BATCH_SIZE,
+                show_progress_bar=False
+            ))
+        
+        tokenizer, model = self.model
+        scores = []
+        for start in range(0, len(texts), CROSS_ENCODER_BATCH_SIZE):
+            batch = texts[start:start + CROSS_ENCODER_BATCH_SIZE]
+            inputs = tokenizer(
+                [query] * len(batch),
+                batch,
+                padding=True,
+                truncation=True,
+                return_tensors="np"
+            )
+            scores.append(model(**inputs).logits[:, 0])
+        return np.concatenate(scores)
+    
+    def rerank_documents(
+        self,
+        query: str,
+        documents: List[Document],
+        top_k: Optional[int] = None
+    ) -> List[Document]:
+        """按交叉编码器分数重排序"""
+        if not documents:
+            return documents
+        
+        try:
+            scores = self._predict(query, [doc.page_content for doc in documents])
+        except Exception as e:
+            print(f"Cross-encoder reranking failed: {e}")
+            # 回退到基础排序
+            return BasicReranker().rerank_documents(query, documents, top_k or self.top_k)
+        
+        order = np.argsort(-scores)
+        limit = top_k or self.top_k
+        if limit:
+            order = order[:limit]
+        
+        reranked = []
+        for rank, idx in enumerate(order, 1):
+            doc = documents[idx]
+            doc.metadata['rerank_score'] = float(scores[idx])
+            doc.metadata['rerank_rank'] = rank
+            reranked.append(doc)
+        return reranked
+
+def _collection_name(vector_store: VectorStore) -> Optional[str]:
+    """Chroma / Milvus 的集合名；无法识别的向量存储返回 None"""
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        return collection.name
+    if getattr(vector_store, "col", None) is not None:
+        return vector_store.collection_name
+    return None
+
+# 检索结果缓存：(集合名, 查询, 检索参数, 重排序参数) -> 重排序后的文档，按 LRU 淘汰
+# 检索器按请求创建，缓存放在模块级别才能在请求之间复用
+RESULT_CACHE_SIZE = 512
+_RESULT_CACHE: "OrderedDict[Tuple[Hashable, ...], List[Document]]" = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+def invalidate_rerank_cache(collection_name: Optional[str] = None):
+    """清除某个集合（或全部）的检索结果缓存，写入文档后调用"""
+    with _RESULT_CACHE_LOCK:
+        if collection_name is None:
+            _RESULT_CACHE.clear()
+            return
+        for key in [key for key in _RESULT_CACHE if key[0] == collection_name]:
+            del _RESULT_CACHE[key]
+
+def _search_with_embeddings(
+    vector_store: VectorStore,
+    query: str,
+    search_kwargs: Dict[str, Any]
+) -> Tuple[List[Document], List[float], Optional[List[List[float]]]]:
+    """向量检索，同时返回查询向量与各文档向量
+
+    Chroma / Milvus 直接从集合中取出已存储的向量；其他存储无法取得向量时返回 None，
+    由调用方退回到 TF-IDF 相似度，避免每次查询都重新嵌入检索到的文档。
+    """
+    query_embedding = vector_store.embeddings.embed_query(query)
+    k = search_kwargs.get("k", 4)
+    
+    collection = getattr(vector_store, "_collection", None)
+    if collection is not None:
+        result = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=k,
+            where=search_kwargs.get("filter"),
+            include=["documents", "metadatas", "embeddings"]
+        )
+        documents = [
+            Document(page_content=text, metadata=meta or {})
+            for text, meta in zip(result["documents"][0], result["metadatas"][0])
+        ]
+        return documents, query_embedding, result["embeddings"][0]
+    
+    col = getattr(vector_store, "col", None)
+    if col is not None:
+        # Milvus：输出字段中带上向量字段，随检索结果一并返回
+        vector_field = vector_store._vector_field
+        text_field = vector_store._text_field
+        output_fields = [f.name for f in col.schema.fields]
+        result = col.search(
+            data=[query_embedding],
+            anns_field=vector_field,
+            param=vector_store.search_params,
+            limit=k,
+            expr=search_kwargs.get("expr"),
+            output_fields=output_fields
+        )
+        documents, doc_embeddings = [], []
+        for hit in result[0]:
+            data = {field: hit.entity.get(field) for field in output_fields}
+            doc_embeddings.append(list(data.pop(vector_field)))
+            documents.append(Document(page_content=data.pop(text_field), metadata=data))
+        return documents, query_embedding, doc_embeddings
+    
+    return vector_store.similarity_search_by_vector(query_embedding, **search_kwargs), query_embedding, None
 
 class RerankedRetriever(BaseRetriever):
     """带重排序功能的检索器包装器"""
     
-    def __init__(self, base_retriever: BaseRetriever, reranker: BaseReranker):
-        super().__init__()
-        self.base_retriever = base_retriever
-        self.reranker = reranker
+    base_retriever: BaseRetriever
+    reranker: Any
+    # 预先拟合的 TF-IDF 模型（可选），传给 MMR 重排序器
+    vectorizer: Any = None
+    
+    def __init__(self, base_retriever: BaseRetriever, reranker: BaseReranker, vectorizer: Any = None):
+        super().__init__(base_retriever=base_retriever, reranker=reranker, vectorizer=vectorizer)
     
     def _get_relevant_documents(
         self, 
@@ -153,13 +384,117 @@ class RerankedRetriever(BaseRetriever):
         *, 
         run_manager: CallbackManagerForRetrieverRun
     ) -> List[Document]:
-        """获取相关文档并重排序"""
-        # 使用基础检索器获取文档
-        documents = self.base_retriever.get_relevant_documents(
-            query, callbacks=run_manager.get_child()
-        )
+        """获取相关文档并重排序，相同查询直接返回缓存结果"""
+        key = self._cache_key(query)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+        
+        # 重排序器需要嵌入向量且基础检索器为向量检索时，复用检索得到的向量
+        if self._search_with_embeddings():
+            documents, query_embedding, doc_embeddings = _search_with_embeddings(
+                self.base_retriever.vectorstore, query, self.base_retriever.search_kwargs
+            )
+            if doc_embeddings is None:
+                reranked_documents = self._rerank(query, documents)
+            else:
+                reranked_documents = self.reranker.rerank_documents(
+                    query, documents, query_embedding=query_embedding, doc_embeddings=doc_embeddings
+                )
+        else:
+            # 使用基础检索器获取文档
+            documents = self.base_retriever.get_relevant_documents(
+                query, callbacks=run_manager.get_child()
+            )
+            
+            # 使用重排序器重排序
+            reranked_documents = self._rerank(query, documents)
+        
+        self._cache(key, reranked_documents)
+        return reranked_documents
+    
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        """异步获取相关文档并重排序"""
+        key = self._cache_key(query)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
         
-        # 使用重排序器重排序
-        reranked_documents = self.reranker.rerank_documents(query, documents)
+        if self._search_with_embeddings():
+            # 向量存储客户端为同步接口，放到线程中执行以免阻塞事件循环
+            documents, query_embedding, doc_embeddings = await asyncio.to_thread(
+                _search_with_embeddings,
+                self.base_retriever.vectorstore, query, self.base_retriever.search_kwargs
+            )
+            if doc_embeddings is None:
+                reranked_documents = await asyncio.to_thread(self._rerank, query, documents)
+            else:
+                reranked_documents = self.reranker.rerank_documents(
+                    query, documents, query_embedding=query_embedding, doc_embeddings=doc_embeddings
+                )
+        else:
+            documents = await self.base_retriever.aget_relevant_documents(
+                query, callbacks=run_manager.get_child()
+            )
+            # 交叉编码器推理为 CPU 密集的同步调用，放到线程中执行
+            reranked_documents = await asyncio.to_thread(self._rerank, query, documents)
         
-        return reranked_documents
\ No newline at end of file
+        self._cache(key, reranked_documents)
+        return reranked_documents
+    
+    def _cache_key(self, query: str) -> Optional[Tuple[Hashable, ...]]:
+        """检索结果缓存键；无法识别集合（也就无法在写入时失效）的检索器不缓存"""
+        if not isinstance(self.base_retriever, VectorStoreRetriever):
+            return None
+        collection_name = _collection_name(self.base_retriever.vectorstore)
+        if collection_name is None:
+            return None
+        return (
+            collection_name,
+            query,
+            self.base_retriever.search_type,
+            repr(sorted(self.base_retriever.search_kwargs.items())),
+            self.reranker.cache_key
+        )
+    
+    @staticmethod
+    def _get_cached(key: Optional[Tuple[Hashable, ...]]) -> Optional[List[Document]]:
+        if key is None:
+            return None
+        with _RESULT_CACHE_LOCK:
+            documents = _RESULT_CACHE.get(key)
+            if documents is None:
+                return None
+            _RESULT_CACHE.move_to_end(key)
+        # 返回副本，调用方修改元数据不影响缓存
+        return copy.deepcopy(documents)
+    
+    @staticmethod
+    def _cache(key: Optional[Tuple[Hashable, ...]], documents: List[Document]):
+        if key is None:
+            return
+        documents = copy.deepcopy(documents)
+        with _RESULT_CACHE_LOCK:
+            _RESULT_CACHE[key] = documents
+            _RESULT_CACHE.move_to_end(key)
+            if len(_RESULT_CACHE) > RESULT_CACHE_SIZE:
+                _RESULT_CACHE.popitem(last=False)
+    
+    def _rerank(self, query: str, documents: List[Document]) -> List[Document]:
+        if self.vectorizer is not None:
+            return self.reranker.rerank_documents(query, documents, vectorizer=self.vectorizer)
+        return self.reranker.rerank_documents(query, documents)
+    
+    def _search_with_embeddings(self) -> bool:
+        """是否直接检索文档及其嵌入向量"""
+        return (
+            getattr(self.reranker, "uses_embeddings", False)
+            and isinstance(self.base_retriever, VectorStoreRetriever)
+            and self.base_retriever.search_type == "similarity"
+            and self.base_retriever.vectorstore.embeddings is not None
+        )
@@ -1,17 +1,90 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 from langchain_core.vectorstores import VectorStore
 from langchain_core.embeddings import Embeddings
 from langchain_chroma import Chroma
 from langchain_community.vectorstores import Milvus
 from ..config import AppConfig
+import asyncio
 import os
+import threading
+import time
+import uuid
+import numpy as np
 from pathlib import Path
 
+# 所有嵌入提供方输出均为 L2 归一化向量，余弦相似度等价于内积，新建集合直接使用内积度量
+_CHROMA_COLLECTION_METADATA = {"hnsw:space": "ip"}
+_MILVUS_INDEX_PARAMS = {
+    "metric_type": "IP",
+    "index_type": "HNSW",
+    "params": {"M": 8, "efConstruction": 64},
+}
+
+# Milvus 集合列表的缓存时间（秒），管理界面会频繁轮询
+MILVUS_LIST_TTL = 5
+
+# 写入向量存储时每批嵌入的文本条数
+INGEST_BATCH_SIZE = 256
+# 异步写入时同时进行的嵌入批次数
+INGEST_CONCURRENCY = 4
+
+def _normalize(vectors: List[List[float]]) -> List[List[float]]:
+    """L2 归一化：写入后内积即余弦相似度，检索与 MMR 都不必再逐次归一化"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+    return matrix.tolist()
+
+def _accepts_embeddings(vector_store: VectorStore) -> bool:
+    """向量存储能否直接写入预先计算好的向量"""
+    return getattr(vector_store, "_collection", None) is not None or hasattr(vector_store, "add_embeddings")
+
+def _add_embedded(
+    vector_store: VectorStore,
+    texts: List[str],
+    vectors: List[List[float]],
+    metadatas: List[Dict[str, Any]]
+) -> List[str]:
+    """写入已嵌入的文本，不再经过向量存储内部的嵌入调用"""
+    collection = getattr(vector_store, "_collection", None)
+    if collection is None:
+        return vector_store.add_embeddings(text_embeddings=list(zip(texts, vectors)), metadatas=metadatas)
+    
+    # Chroma：直接写入底层集合；Chroma 不接受空的元数据字典，有无元数据的文本分开写入
+    ids = [str(uuid.uuid4()) for _ in texts]
+    with_meta = [i for i, meta in enumerate(metadatas) if meta]
+    without_meta = [i for i, meta in enumerate(metadatas) if not meta]
+    if with_meta:
+        collection.add(
+            ids=[ids[i] for i in with_meta],
+            documents=[texts[i] for i in with_meta],
+            embeddings=[vectors[i] for i in with_meta],
+            metadatas=[metadatas[i] for i in with_meta]
+        )
+    if without_meta:
+        collection.add(
+            ids=[ids[i] for i in without_meta],
+            documents=[texts[i] for i in without_meta],
+            embeddings=[vectors[i] for i in without_meta]
+        )
+    return ids
+
 class VectorStoreFactory:
     """向量存储工厂类"""
     
     def __init__(self, config: AppConfig):
         self.config = config
+        # Chroma 实例缓存：(集合名, id(嵌入模型)) -> Chroma；缓存的实例持有嵌入模型，id 不会被复用
+        self._chroma_cache: Dict[Tuple[str, int], Chroma] = {}
+        self._chroma_lock = threading.Lock()
+        # Milvus 集合列表缓存：(过期时间, 集合列表)
+        self._milvus_collections: Optional[Tuple[float, List[str]]] = None
+        
+        if config.vector_store == "milvus":
+            try:
+                self._ensure_milvus_connection()
+            except Exception as e:
+                # 启动时 Milvus 不可用不影响创建工厂，使用时会再次尝试连接
+                print(f"Error connecting to Milvus: {e}")
     
     def get_vector_store(
         self, 
@@ -27,17 +100,47 @@ class VectorStoreFactory:
         else:
             raise ValueError(f"Unsupported vector store: {self.config.vector_store}")
     
+    async def aget_vector_store(
+        self, 
+        collection_name: str, 
+        embeddings: Embeddings,
+        **kwargs
+    ) -> VectorStore:
+        """异步获取向量存储实例（打开集合涉及磁盘 / 网络 I/O，在线程中执行）"""
+        return await asyncio.to_thread(self.get_vector_store, collection_name, embeddings, **kwargs)
+    
     def _create_chroma_store(
         self, 
         collection_name: str, 
         embeddings: Embeddings,
         **kwargs
     ) -> Chroma:
-        """创建 Chroma 向量存储"""
+        """创建 Chroma 向量存储（无额外参数时复用已打开的实例）"""
+        if kwargs:
+            return self._open_chroma_store(collection_name, embeddings, **kwargs)
+        
+        key = (collection_name, id(embeddings))
+        store = self._chroma_cache.get(key)
+        if store is None:
+            with self._chroma_lock:
+                store = self._chroma_cache.get(key)
+                if store is None:
+                    store = self._open_chroma_store(collection_name, embeddings)
+                    self._chroma_cache[key] = store
+        return store
+    
+    def _open_chroma_store(
+        self, 
+        collection_name: str, 
+        embeddings: Embeddings,
+        **kwargs
+    ) -> Chroma:
         # 确保存储目录存在
         persist_directory = Path(self.config.chroma_dir) / collection_name
         persist_directory.mkdir(parents=True, exist_ok=True)
         
+        # 度量方式只在创建集合时生效，已有集合保持原设置
+        kwargs.setdefault("collection_metadata", dict(_CHROMA_COLLECTION_METADATA))
         return Chroma(
             collection_name=collection_name,
             embedding_function=embeddings,
@@ -57,6 +160,7 @@ class VectorStoreFactory:
             "port": self.config.milvus_port,
         }
         
+        kwargs.setdefault("index_params", dict(_MILVUS_INDEX_PARAMS))
         return Milvus(
             embedding_function=embeddings,
             collection_name=collection_name,
@@ -64,6 +168,53 @@ class VectorStoreFactory:
             **kwargs
         )
     
+    def ingest(
+        self,
+        vector_store: VectorStore,
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        batch_size: int = INGEST_BATCH_SIZE
+    ) -> List[str]:
+        """按批嵌入并写入文本，每批一次嵌入调用"""
+        metadatas = metadatas or [{} for _ in texts]
+        ids: List[str] = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            metas = metadatas[start:start + batch_size]
+            if _accepts_embeddings(vector_store):
+                vectors = _normalize(vector_store.embeddings.embed_documents(batch))
+                ids.extend(_add_embedded(vector_store, batch, vectors, metas))
+            else:
+                ids.extend(vector_store.add_texts(batch, metadatas=metas))
+        return ids
+    
+    async def aingest(
+        self,
+        vector_store: VectorStore,
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        batch_size: int = INGEST_BATCH_SIZE,
+        concurrent_batches: int = INGEST_CONCURRENCY
+    ) -> List[str]:
+        """异步版本：多个批次的嵌入请求并发进行，写入仍按批次顺序执行"""
+        if not _accepts_embeddings(vector_store):
+            return await asyncio.to_thread(self.ingest, vector_store, texts, metadatas, batch_size)
+        
+        metadatas = metadatas or [{} for _ in texts]
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        semaphore = asyncio.Semaphore(concurrent_batches)
+        
+        async def embed(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return _normalize(await vector_store.embeddings.aembed_documents(batch))
+        
+        all_vectors = await asyncio.gather(*(embed(batch) for batch in batches))
+        ids: List[str] = []
+        for index, (batch, vectors) in enumerate(zip(batches, all_vectors)):
+            metas = metadatas[index * batch_size:(index + 1) * batch_size]
+            ids.extend(await asyncio.to_thread(_add_embedded, vector_store, batch, vectors, metas))
+        return ids
+    
     def list_collections(self) -> list[str]:
         """列出所有集合"""
         if self.config.vector_store == "chroma":
@@ -73,33 +224,46 @@ class VectorStoreFactory:
         else:
             return []
     
+    async def alist_collections(self) -> list[str]:
+        """异步列出所有集合"""
+        return await asyncio.to_thread(self.list_collections)
+    
     def _list_chroma_collections(self) -> list[str]:
         """列出 Chroma 集合"""
-        chroma_dir = Path(self.config.chroma_dir)
-        if not chroma_dir.exists():
+        if not os.path.isdir(self.config.chroma_dir):
             return []
         
-        collections = []
-        for item in chroma_dir.iterdir():
-            if item.is_dir():
-                collections.append(item.name)
-        return collections
+        # scandir 的目录项自带文件类型，无需逐项 stat
+        with os.scandir(self.config.chroma_dir) as it:
+            return [entry.name for entry in it if entry.is_dir(follow_symlinks=False)]
+    
+    def _ensure_milvus_connection(self):
+        """建立默认别名的 Milvus 连接（已连接时直接返回，复用同一 gRPC 通道）"""
+        from pymilvus import connections
+        
+        if connections.has_connection("default"):
+            return
+        connections.connect(
+            alias="default",
+            host=self.config.milvus_host,
+            port=self.config.milvus_port
+        )
     
     def _list_milvus_collections(self) -> list[str]:
-        """列出 Milvus 集合"""
+        """列出 Milvus 集合（结果缓存 MILVUS_LIST_TTL 秒）"""
+        cached = self._milvus_collections
+        if cached is not None and cached[0] > time.monotonic():
+            return list(cached[1])
+        
         try:
-            from pymilvus import connections, utility
+            from pymilvus import utility
             
-            # 连接到 Milvus
-            connections.connect(
-                alias="default",
-                host=self.config.milvus_host,
-                port=self.config.milvus_port
-            )
+            self._ensure_milvus_connection()
             
             # 获取所有集合
             collections = utility.list_collections()
-            return collections
+            self._milvus_collections = (time.monotonic() + MILVUS_LIST_TTL, collections)
+            return list(collections)
         except Exception as e:
             print(f"Error listing Milvus collections: {e}")
             return []
@@ -116,9 +280,16 @@ class VectorStoreFactory:
             print(f"Error deleting collection {collection_name}: {e}")
             return False
     
+    async def adelete_collection(self, collection_name: str) -> bool:
+        """异步删除集合"""
+        return await asyncio.to_thread(self.delete_collection, collection_name)
+    
     def _delete_chroma_collection(self, collection_name: str) -> bool:
         """删除 Chroma 集合"""
         import shutil
+        with self._chroma_lock:
+            for key in [key for key in self._chroma_cache if key[0] == collection_name]:
+                del self._chroma_cache[key]
         collection_dir = Path(self.config.chroma_dir) / collection_name
         if collection_dir.exists():
             shutil.rmtree(collection_dir)
@@ -128,16 +299,13 @@ class VectorStoreFactory:
     def _delete_milvus_collection(self, collection_name: str) -> bool:
         """删除 Milvus 集合"""
         try:
-            from pymilvus import connections, utility
+            from pymilvus import utility
             
-            connections.connect(
-                alias="default",
-                host=self.config.milvus_host,
-                port=self.config.milvus_port
-            )
+            self._ensure_milvus_connection()
             
             if utility.has_collection(collection_name):
                 utility.drop_collection(collection_name)
+                self._milvus_collections = None
                 return True
             return False
         except Exception as e: